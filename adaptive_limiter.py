@@ -0,0 +1,245 @@
+"""レイテンシに応じて同時実行数を自動調整するリミッター（AIMD）
+
+LINE WORKS API への同時リクエスト数（in-flight）の上限を、観測した
+レイテンシと 429 応答から調整する。
+
+  - レイテンシが基準値（最小レイテンシの追従値）付近で安定していれば、
+    上限を 1 往復あたり 1 ずつ増やす（加算的増加）
+  - レイテンシが基準値の tolerance 倍を超えるか 429 / 5xx / 通信エラーが
+    発生したら、上限を backoff 倍に減らす（乗算的減少）
+
+空いた枠は送信の種類ごとのレーン（interactive / transactional / bulk）に
+重み付き公平スケジューリングで割り当てる。各レーンは現在の上限のうち
+share の割合までしか同時に使えないため、大量の一斉送信（bulk）が
+対話的な返信（interactive）の枠を使い切ることはない。
+
+リミッターはプロセス（Lambdaコンテナ）単位で保持する。
+"""
+import os
+import threading
+import time
+from collections import deque
+
+# 送信レーン
+LANE_INTERACTIVE = 'interactive'      # Webhook への返信
+LANE_TRANSACTIONAL = 'transactional'  # /send_message・予約メッセージ
+LANE_BULK = 'bulk'                    # 一斉送信・デッドレターの再送
+
+# レーンごとの既定値（weight: 競合時の配分比、share: 上限のうち使える割合）
+DEFAULT_LANES = {
+    LANE_INTERACTIVE: {"weight": 6.0, "share": 1.0},
+    LANE_TRANSACTIONAL: {"weight": 3.0, "share": 0.8},
+    LANE_BULK: {"weight": 1.0, "share": 0.5}
+}
+
+
+class _Lane:
+    __slots__ = ('name', 'weight', 'share', 'waiters', 'in_flight', 'virtual_time',
+                 'granted', 'total_wait', 'max_wait')
+
+    def __init__(self, name, weight, share):
+        self.name = name
+        self.weight = weight
+        self.share = share
+        self.waiters = deque()
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+def parse_lane_settings(weights=None, shares=None):
+    """'interactive:6,bulk:1' 形式の設定を DEFAULT_LANES に上書きした dict を返す"""
+    lanes = {name: dict(config) for name, config in DEFAULT_LANES.items()}
+    for field, text in (("weight", weights), ("share", shares)):
+        for item in (text or '').split(','):
+            if not item.strip():
+                continue
+            name, _, value = item.partition(':')
+            lanes.setdefault(name.strip(), {"weight": 1.0, "share": 1.0})[field] = float(value)
+    return lanes
+
+
+class AdaptiveLimiter:
+    """AIMD 方式の同時実行数リミッター"""
+
+    def __init__(self, name, initial_limit=4, min_limit=1, max_limit=32,
+                 tolerance=2.0, backoff=0.7, lanes=None, default_lane=LANE_TRANSACTIONAL):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.default_lane = default_lane
+        self._lanes = {
+            lane_name: _Lane(lane_name, config["weight"], config["share"])
+            for lane_name, config in (lanes or DEFAULT_LANES).items()
+        }
+        self._virtual_clock = 0.0
+
+        self._condition = threading.Condition()
+        self._limit = float(max(min_limit, min(max_limit, initial_limit)))
+        self._in_flight = 0
+        self._baseline = None
+        self._last_latency = None
+        self._last_decrease = 0.0
+        self._increases = 0
+        self._decreases = 0
+        self._throttled = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _lane(self, lane):
+        return self._lanes.get(lane) or self._lanes[self.default_lane]
+
+    def _lane_cap(self, lane):
+        """レーンが同時に使える枠の数（上限 × share、最低1）"""
+        return max(1, int(int(self._limit) * lane.share))
+
+    def _next_waiter(self):
+        """次に枠を割り当てる待機中のリクエスト（仮想時間が最も小さいレーンの先頭）"""
+        limit = int(self._limit)
+        if self._in_flight >= limit:
+            return None
+        selected = None
+        for lane in self._lanes.values():
+            if not lane.waiters or lane.in_flight >= self._lane_cap(lane):
+                continue
+            if selected is None or lane.virtual_time < selected.virtual_time:
+                selected = lane
+        return selected.waiters[0] if selected is not None else None
+
+    def acquire(self, lane=None):
+        """レーンの順番が来て同時実行数が上限未満になるまで待ち、枠を確保する"""
+        lane = self._lane(lane)
+        ticket = object()
+        enqueued = time.monotonic()
+        with self._condition:
+            if not lane.waiters:
+                # しばらく空いていたレーンが溜まった仮想時間で他のレーンを追い越さないようにする
+                lane.virtual_time = max(lane.virtual_time, self._virtual_clock)
+            lane.waiters.append(ticket)
+            while self._next_waiter() is not ticket:
+                self._condition.wait()
+            lane.waiters.popleft()
+
+            lane.in_flight += 1
+            self._in_flight += 1
+            lane.virtual_time += 1.0 / lane.weight
+            self._virtual_clock = lane.virtual_time
+
+            started = time.monotonic()
+            waited = started - enqueued
+            lane.granted += 1
+            lane.total_wait += waited
+            if waited > lane.max_wait:
+                lane.max_wait = waited
+            # 枠が残っていれば次の待機者も進める
+            self._condition.notify_all()
+            return started
+
+    def release(self, started, status_code=None, error=False, lane=None):
+        """枠を解放し、結果に応じて上限を調整する
+
+        started は acquire() の戻り値。status_code は HTTP ステータス（通信エラー時は None）。
+        lane は acquire() に渡したレーン。
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            in_flight = self._in_flight
+            lane = self._lane(lane)
+            # 需要はレーンごとに数える: 全体の上限まで使っているか、このレーンが自分の枠まで使って
+            # なお待機者がいる（枠は上限に比例するので、上限を増やさないと一斉送信だけの負荷では伸びない）
+            saturated = (
+                in_flight >= int(self._limit)
+                or (lane.waiters and lane.in_flight >= self._lane_cap(lane))
+            )
+            self._in_flight -= 1
+            lane.in_flight -= 1
+            self._last_latency = latency
+
+            overloaded = error or status_code == 429 or (status_code is not None and status_code >= 500)
+            if status_code == 429:
+                self._throttled += 1
+
+            if not overloaded:
+                # 基準値は最小レイテンシに追従し、ゆっくり上方向にも適応させる
+                if self._baseline is None or latency < self._baseline:
+                    self._baseline = latency
+                else:
+                    self._baseline += (latency - self._baseline) * 0.01
+                if latency > self._baseline * self.tolerance:
+                    overloaded = True
+
+            if overloaded:
+                # 同じ混雑で何度も減らさないよう、1往復に1回まで
+                if now - self._last_decrease >= latency:
+                    self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                    self._last_decrease = now
+                    self._decreases += 1
+            elif saturated:
+                # 使っていない上限は増やさない
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+                self._increases += 1
+
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """メトリクス（現在の上限・実行中の数・基準レイテンシ）を返す"""
+        with self._condition:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "baseline_latency_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+                "last_latency_ms": round(self._last_latency * 1000, 1) if self._last_latency is not None else None,
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "throttled": self._throttled,
+                "lanes": {
+                    lane.name: {
+                        "weight": lane.weight,
+                        "max_in_flight": self._lane_cap(lane),
+                        "in_flight": lane.in_flight,
+                        "queue_depth": len(lane.waiters),
+                        "granted": lane.granted,
+                        "avg_wait_ms": round(lane.total_wait / lane.granted * 1000, 1) if lane.granted else None,
+                        "max_wait_ms": round(lane.max_wait * 1000, 1)
+                    }
+                    for lane in self._lanes.values()
+                }
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """名前付きリミッターを取得（設定は環境変数から読み込む）"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = AdaptiveLimiter(
+                    name,
+                    initial_limit=int(os.environ.get('ADAPTIVE_INITIAL_LIMIT', '4')),
+                    min_limit=int(os.environ.get('ADAPTIVE_MIN_LIMIT', '1')),
+                    max_limit=int(os.environ.get('ADAPTIVE_MAX_LIMIT', '32')),
+                    tolerance=float(os.environ.get('ADAPTIVE_LATENCY_TOLERANCE', '2.0')),
+                    lanes=parse_lane_settings(
+                        os.environ.get('OUTBOUND_LANE_WEIGHTS'),
+                        os.environ.get('OUTBOUND_LANE_SHARES')
+                    )
+                )
+                _limiters[name] = limiter
+    return limiter
+
+
+def snapshot_all():
+    """すべてのリミッターのメトリクスを返す"""
+    return {name: limiter.snapshot() for name, limiter in list(_limiters.items())}
@@ -0,0 +1,514 @@
+"""送受信メッセージの監査ログ（分析用エクスポート）
+
+受信した Webhook イベントと送信結果を、日付・時間でパーティション分割したファイルにまとめて保存する。
+
+    <prefix>/dt=2025-06-11/hour=12/part-<時刻>-<ID>.ndjson.gz
+
+レコードの送り方は AUDIT_SHIPPER で選ぶ（Lambda 上の既定は log、それ以外は direct）。
+- log: 1レコードを JSON の1行として標準出力に書くだけで、リクエストの処理中に S3 へは書き込まない。
+  Lambda のログは CloudWatch Logs へ非同期に転送されるので、サブスクリプションフィルター
+  （{ $.audit_v = 1 }）から Kinesis Data Firehose で S3 に集約し、compact コマンドを定期的に
+  実行してパーティションのファイルにまとめる。
+- direct: プロセス内のバッファに溜め、一定件数ごとにパーティションのファイルへ書き出す
+  （ローカル開発サーバーや長時間動くプロセス向け）。
+
+ファイルは列指向の NDJSON（1行目がヘッダー、以降は1列1行で値の配列）を gzip 圧縮したもの。
+AUDIT_FORMAT=parquet かつ pyarrow が利用可能な場合は Parquet で書き出す。
+書き出し先はローカルディスク（AUDIT_PATH）か、AUDIT_S3_BUCKET を指定した場合は
+S3 互換ストレージ（boto3 を使用）。既存ファイルは書き換えず、フラッシュごとに新しいファイルを追加する。
+AUDIT_S3_BUCKET を指定しない場合は AUDIT_ENABLED=true を明示したときだけ有効にする（ローカル検証用）。
+
+query() は指定した期間に該当するパーティションだけを読み込む。
+
+使い方:
+    python audit_log.py compact s3://audit-firehose/2025/06/11/12/
+    python audit_log.py query --start 2025-06-11T00:00 --end 2025-06-12T00:00 --direction sent
+    python audit_log.py query --start 2025-06-11T00:00 --count-by status
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# ローカル保存先の既定パス（Lambdaでは /tmp のみ書き込み可能）
+DEFAULT_PATH = '/tmp/audit'
+
+DIRECTION_RECEIVED = 'received'
+DIRECTION_SENT = 'sent'
+
+# 列の並び（ファイルのスキーマ）
+COLUMNS = (
+    'ts', 'direction', 'source', 'event_type', 'content_type',
+    'bot_id', 'user_id', 'channel_id', 'status', 'status_code',
+    'latency_ms', 'text_length'
+)
+
+SHIPPER_LOG = 'log'
+SHIPPER_DIRECT = 'direct'
+
+# ログ転送するレコードの目印（サブスクリプションフィルターと compact() で使う）
+LOG_RECORD_VERSION = 1
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_PARQUET = 'parquet'
+
+_EXTENSIONS = {
+    FORMAT_NDJSON: '.ndjson.gz',
+    FORMAT_PARQUET: '.parquet'
+}
+
+
+def partition_prefix(ts):
+    """Unix時間が属するパーティション（UTC の日付・時間）"""
+    moment = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return f"dt={moment:%Y-%m-%d}/hour={moment:%H}"
+
+
+def make_row(direction, source, event_type=None, content_type=None, bot_id=None,
+             user_id=None, channel_id=None, status=None, status_code=None,
+             latency_ms=None, text_length=None):
+    """COLUMNS の順に並べたレコード"""
+    return (time.time(), direction, source, event_type, content_type, bot_id, user_id,
+            channel_id, status, status_code, latency_ms, text_length)
+
+
+def encode_log_line(row):
+    """レコードをログ転送用の JSON の1行にする"""
+    record = {"audit_v": LOG_RECORD_VERSION}
+    record.update(zip(COLUMNS, row))
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_log_rows(text):
+    """転送されたログからレコードを取り出すジェネレーター
+
+    JSON の行のほか、前置きの付いたログ行や、Firehose が改行なしで連結して届ける
+    CloudWatch Logs のサブスクリプション形式（logEvents の配列）も読める。
+    """
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        start = text.find('{', position)
+        if start < 0:
+            return
+        try:
+            value, position = decoder.raw_decode(text, start)
+        except ValueError:
+            position = start + 1
+            continue
+        if not isinstance(value, dict):
+            continue
+        if 'logEvents' in value:
+            for event in value['logEvents']:
+                yield from iter_log_rows(event.get('message', ''))
+        elif value.get('audit_v') == LOG_RECORD_VERSION:
+            yield tuple(value.get(name) for name in COLUMNS)
+
+
+def encode_ndjson(columns):
+    """列の dict を列指向 NDJSON（gzip）のバイト列にする"""
+    rows = len(columns[COLUMNS[0]])
+    lines = [json.dumps({"columns": list(COLUMNS), "rows": rows}, separators=(',', ':'))]
+    for name in COLUMNS:
+        lines.append(json.dumps({"column": name, "values": columns[name]},
+                                ensure_ascii=False, separators=(',', ':')))
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+def decode_ndjson(data, columns=None):
+    """列指向 NDJSON（gzip）を列の dict に戻す（columns を指定した列だけ）"""
+    result = {}
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+        header = json.loads(f.readline())
+        wanted = set(columns or header["columns"])
+        for line in f:
+            if not line.strip():
+                continue
+            # 列名だけ先に確認し、不要な列は値をパースしない
+            name = json.loads(line[:line.index(b',"values"')] + b'}')["column"]
+            if name in wanted:
+                result[name] = json.loads(line)["values"]
+    return result
+
+
+def _load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def encode_parquet(columns):
+    pyarrow = _load_pyarrow()
+    table = pyarrow.table({name: columns[name] for name in COLUMNS})
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(table, buffer, compression='snappy')
+    return buffer.getvalue()
+
+
+def decode_parquet(data, columns=None):
+    pyarrow = _load_pyarrow()
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required to read Parquet audit files")
+    table = pyarrow.parquet.read_table(io.BytesIO(data), columns=list(columns) if columns else None)
+    return table.to_pydict()
+
+
+class LocalAuditSink:
+    """ローカルディスクへの書き出し"""
+
+    def __init__(self, base_path=None):
+        self.base_path = base_path or os.environ.get('AUDIT_PATH', DEFAULT_PATH)
+
+    def write(self, key, data):
+        path = os.path.join(self.base_path, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まれないよう、一時ファイルから rename する
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def list(self, partition):
+        directory = os.path.join(self.base_path, partition)
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return []
+        return [f"{partition}/{name}" for name in names if not name.endswith('.tmp')]
+
+    def read(self, key):
+        with open(os.path.join(self.base_path, key), 'rb') as f:
+            return f.read()
+
+
+class S3AuditSink:
+    """S3 互換ストレージへの書き出し（boto3 は Lambda のランタイムに同梱）"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def write(self, key, data):
+        self._client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def list(self, partition):
+        keys = []
+        paginator = self._client.get_paginator('list_objects_v2')
+        prefix = self._object_key(partition) + '/'
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                keys.append(f"{partition}/{item['Key'][len(prefix):]}")
+        return sorted(keys)
+
+    def read(self, key):
+        return self._client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body'].read()
+
+
+class AuditLog:
+    """監査レコードのバッファとバッチ書き出し"""
+
+    def __init__(self, sink, batch_size=None, file_format=None):
+        self.sink = sink
+        self.batch_size = batch_size or int(os.environ.get('AUDIT_BATCH_SIZE', '500'))
+
+        file_format = file_format or os.environ.get('AUDIT_FORMAT', FORMAT_NDJSON)
+        if file_format == FORMAT_PARQUET and _load_pyarrow() is None:
+            logger.warning("pyarrow is not installed, writing audit files as ndjson")
+            file_format = FORMAT_NDJSON
+        self.file_format = file_format
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self.flushed_records = 0
+        self.flushed_files = 0
+        self.failed_flushes = 0
+
+    def record(self, direction, source, **fields):
+        """レコードをバッファに追加（バッチサイズに達したら書き出す）"""
+        self.append_rows([make_row(direction, source, **fields)])
+
+    def append_rows(self, rows):
+        """レコードの行をバッファに追加し、バッチサイズに達するたびに書き出す（書き出した件数を返す）"""
+        written = 0
+        for row in rows:
+            with self._lock:
+                self._buffer.append(row)
+                full = len(self._buffer) >= self.batch_size
+            if full:
+                written += self.flush()
+        return written
+
+    def flush(self):
+        """バッファの内容をパーティションごとのファイルに書き出し、書き出した件数を返す"""
+        with self._lock:
+            rows = self._buffer
+            self._buffer = []
+        if not rows:
+            return 0
+
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(partition_prefix(row[0]), []).append(row)
+
+        written = 0
+        encode = encode_parquet if self.file_format == FORMAT_PARQUET else encode_ndjson
+        for partition, partition_rows in partitions.items():
+            columns = {name: [row[index] for row in partition_rows] for index, name in enumerate(COLUMNS)}
+            key = (f"{partition}/part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+                   f"{_EXTENSIONS[self.file_format]}")
+            try:
+                self.sink.write(key, encode(columns))
+            except Exception as e:
+                # 書き出せなかったレコードは次回のフラッシュで再試行する
+                logger.error(f"Failed to write audit partition {partition}: {str(e)}")
+                self.failed_flushes += 1
+                with self._lock:
+                    self._buffer[:0] = partition_rows
+                continue
+            written += len(partition_rows)
+            self.flushed_files += 1
+
+        self.flushed_records += written
+        logger.info(f"Flushed {written} audit records to {len(partitions)} partitions")
+        return written
+
+    def stats(self):
+        return {
+            "shipper": SHIPPER_DIRECT,
+            "buffered": len(self._buffer),
+            "flushed_records": self.flushed_records,
+            "flushed_files": self.flushed_files,
+            "failed_flushes": self.failed_flushes,
+            "format": self.file_format
+        }
+
+
+class LogShipper:
+    """レコードを1件ずつ JSON の1行として標準出力に書く（AUDIT_SHIPPER=log）
+
+    Lambda では標準出力がランタイムによって CloudWatch Logs へ非同期に転送されるため、
+    呼び出しごとの S3 への書き込みや小さなファイルが生じない。ファイルへの集約は compact() が行う。
+    """
+
+    def __init__(self, stream=None):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self.shipped_records = 0
+
+    def record(self, direction, source, **fields):
+        line = encode_log_line(make_row(direction, source, **fields)) + '\n'
+        stream = self._stream or sys.stdout
+        # 並行するスレッドの行が混ざらないよう1行ずつ書く
+        with self._lock:
+            stream.write(line)
+            self.shipped_records += 1
+
+    def flush(self):
+        """書き出しは record() で済んでいるため、標準出力のバッファを流すだけ"""
+        (self._stream or sys.stdout).flush()
+        return 0
+
+    def stats(self):
+        return {
+            "shipper": SHIPPER_LOG,
+            "shipped_records": self.shipped_records
+        }
+
+
+def compact(audit, texts):
+    """転送されたログのレコードをパーティションのファイルにまとめて書き出し、書き出した件数を返す"""
+    written = 0
+    for text in texts:
+        written += audit.append_rows(iter_log_rows(text))
+    return written + audit.flush()
+
+
+def _partitions_between(start, end):
+    """期間 [start, end) に含まれる時間単位のパーティション"""
+    moment = datetime.fromtimestamp(start, tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+    last = datetime.fromtimestamp(end, tz=timezone.utc)
+    while moment < last:
+        yield f"dt={moment:%Y-%m-%d}/hour={moment:%H}"
+        moment += timedelta(hours=1)
+
+
+def query(sink, start, end=None, filters=None, columns=None):
+    """期間内のレコードを dict で返すジェネレーター
+
+    該当する日付・時間のパーティションのファイルだけを読み込む。
+    filters は {列名: 値} の完全一致条件。columns を指定するとその列だけを返す。
+    """
+    end = end if end is not None else time.time()
+    filters = filters or {}
+    read_columns = set(columns or COLUMNS) | set(filters) | {'ts'}
+
+    for partition in _partitions_between(start, end):
+        for key in sink.list(partition):
+            data = sink.read(key)
+            if key.endswith(_EXTENSIONS[FORMAT_PARQUET]):
+                table = decode_parquet(data, read_columns)
+            else:
+                table = decode_ndjson(data, read_columns)
+            for index, ts in enumerate(table['ts']):
+                if not start <= ts < end:
+                    continue
+                if any(table[name][index] != value for name, value in filters.items()):
+                    continue
+                yield {name: table[name][index] for name in (columns or COLUMNS)}
+
+
+def get_sink():
+    """環境変数の設定に応じた書き出し先を返す"""
+    bucket = os.environ.get('AUDIT_S3_BUCKET')
+    if bucket:
+        return S3AuditSink(
+            bucket,
+            prefix=os.environ.get('AUDIT_S3_PREFIX', 'audit'),
+            endpoint_url=os.environ.get('AUDIT_S3_ENDPOINT_URL')
+        )
+    return LocalAuditSink()
+
+
+_UNRESOLVED = object()
+_default_log = _UNRESOLVED
+_default_log_lock = threading.Lock()
+
+
+def create_audit_log():
+    """環境変数の設定に応じた監査ログを生成（無効の場合は None）"""
+    default_enabled = 'true' if os.environ.get('AUDIT_S3_BUCKET') else 'false'
+    if os.environ.get('AUDIT_ENABLED', default_enabled).lower() != 'true':
+        return None
+    on_lambda = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+    shipper = os.environ.get('AUDIT_SHIPPER', SHIPPER_LOG if on_lambda else SHIPPER_DIRECT).lower()
+    if shipper == SHIPPER_LOG:
+        return LogShipper()
+    if shipper != SHIPPER_DIRECT:
+        raise ValueError(f"Unknown AUDIT_SHIPPER: {shipper}")
+    if on_lambda:
+        logger.warning("AUDIT_SHIPPER=direct writes small audit files from each Lambda invocation; use log instead")
+    return AuditLog(get_sink())
+
+
+def get_audit_log():
+    """プロセス内で共有する監査ログを取得（無効の場合は None）
+
+    AUDIT_ENABLED の既定値は、AUDIT_S3_BUCKET が指定されていれば true、なければ false。
+    設定は最初の呼び出しで一度だけ読み、レコードごとに環境変数を読み直さない。
+    """
+    global _default_log
+    audit = _default_log
+    if audit is _UNRESOLVED:
+        with _default_log_lock:
+            if _default_log is _UNRESOLVED:
+                _default_log = create_audit_log()
+            audit = _default_log
+    return audit
+
+
+def record(direction, source, **fields):
+    """共有の監査ログにレコードを追加（無効時や失敗時は何もしない）"""
+    try:
+        audit = get_audit_log()
+        if audit is not None:
+            audit.record(direction, source, **fields)
+    except Exception as e:
+        logger.error(f"Failed to record audit event: {str(e)}")
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+
+
+def _decode_input(data):
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return data.decode('utf-8')
+
+
+def _read_inputs(paths):
+    """ローカルのファイル、または s3://バケット/プレフィックス 配下のオブジェクトを順に読む"""
+    for path in paths:
+        if not path.startswith('s3://'):
+            with open(path, 'rb') as f:
+                yield _decode_input(f.read())
+            continue
+        import boto3
+        bucket, _, prefix = path[len('s3://'):].partition('/')
+        client = boto3.client('s3', endpoint_url=os.environ.get('AUDIT_S3_ENDPOINT_URL'))
+        for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield _decode_input(client.get_object(Bucket=bucket, Key=item['Key'])['Body'].read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='監査ログの集約と検索')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compact_parser = subparsers.add_parser('compact', help='転送されたログをパーティションのファイルにまとめる')
+    compact_parser.add_argument('inputs', nargs='+', help='ログのファイル、または s3://バケット/プレフィックス')
+    compact_parser.add_argument('--batch-size', type=int, default=100000,
+                                help='1ファイルにまとめる最大件数')
+
+    query_parser = subparsers.add_parser('query', help='期間内のレコードを表示')
+    query_parser.add_argument('--start', required=True, help='開始時刻（Unix時間または ISO 8601、UTC）')
+    query_parser.add_argument('--end', help='終了時刻（省略時は現在時刻）')
+    query_parser.add_argument('--direction', choices=[DIRECTION_RECEIVED, DIRECTION_SENT])
+    query_parser.add_argument('--source')
+    query_parser.add_argument('--user-id')
+    query_parser.add_argument('--status')
+    query_parser.add_argument('--count-by', choices=COLUMNS, help='指定した列ごとの件数を表示')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        audit = AuditLog(get_sink(), batch_size=args.batch_size)
+        written = compact(audit, _read_inputs(args.inputs))
+        print(json.dumps({"written": written, **audit.stats()}, ensure_ascii=False, indent=2))
+        if audit.failed_flushes:
+            sys.exit(1)
+        return
+
+    filters = {}
+    for name in ('direction', 'source', 'user_id', 'status'):
+        value = getattr(args, name)
+        if value is not None:
+            filters[name] = value
+
+    rows = query(get_sink(), _parse_time(args.start), _parse_time(args.end), filters=filters,
+                 columns=[args.count_by] if args.count_by else None)
+    if args.count_by:
+        counts = Counter(row[args.count_by] for row in rows)
+        print(json.dumps(dict(counts.most_common()), ensure_ascii=False, indent=2))
+    else:
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""メッセージテンプレート描画のベンチマーク
+
+一斉送信の規模（宛先ごとにパラメーターが異なる）で、1メッセージあたりの描画コストを比較する。
+
+  naive format    毎回テンプレート文字列を取り出して str.format で描画
+  f-string        コードに埋め込んだ f-string（従来のエコー返信と同じ方式）
+  registry        TemplateRegistry.render（キャッシュの参照とロケールのフォールバック込み）
+  compiled        get() で取得済みの描画関数を直接呼び出す（描画そのもののコスト）
+
+使い方:
+    python benchmarks/template_render.py --recipients 10000 --templates 300
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_templates import TemplateRegistry  # noqa: E402
+
+
+def build_templates(count):
+    """通知種別ごとのテンプレート（パラメーター3つ）を生成"""
+    return {
+        f"notice_{i:04d}": f"【通知{i}】{{name}} さん、{{title}} が {{time}} に更新されました"
+        for i in range(count)
+    }
+
+
+def build_recipients(count):
+    return [
+        {"name": f"ユーザー{i}", "title": f"申請 #{i}", "time": f"{i % 24:02d}:00"}
+        for i in range(count)
+    ]
+
+
+def timed(label, func, recipients, template_ids, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for index, params in enumerate(recipients):
+            func(template_ids[index % len(template_ids)], params)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return label, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='テンプレート描画のコストを比較')
+    parser.add_argument('--recipients', type=int, default=10000, help='一斉送信の宛先数')
+    parser.add_argument('--templates', type=int, default=300, help='通知種別（テンプレート）の数')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    templates = build_templates(args.templates)
+    template_ids = list(templates)
+    recipients = build_recipients(args.recipients)
+
+    template_dir = tempfile.mkdtemp(prefix='template-bench-')
+    try:
+        with open(os.path.join(template_dir, 'ja.json'), 'w', encoding='utf-8') as f:
+            json.dump(templates, f, ensure_ascii=False)
+
+        started = time.perf_counter()
+        registry = TemplateRegistry(template_dir=template_dir, default_locale='ja', reload_seconds=0)
+        load_ms = (time.perf_counter() - started) * 1000
+
+        def naive(template_id, params):
+            return templates[template_id].format(**params)
+
+        def fstring(template_id, params):
+            return f"【通知】{params['name']} さん、{params['title']} が {params['time']} に更新されました"
+
+        def rendered(template_id, params):
+            return registry.render(template_id, params, 'ja-JP')
+
+        # 初回のコンパイルはキャッシュに載せてから計測する
+        compiled = {template_id: registry.get(template_id, 'ja-JP') for template_id in template_ids}
+
+        def compiled_only(template_id, params):
+            return compiled[template_id](params)
+
+        results = [
+            timed("naive format", naive, recipients, template_ids, args.repeat),
+            timed("f-string", fstring, recipients, template_ids, args.repeat),
+            timed("registry", rendered, recipients, template_ids, args.repeat),
+            timed("compiled", compiled_only, recipients, template_ids, args.repeat),
+        ]
+    finally:
+        shutil.rmtree(template_dir, ignore_errors=True)
+
+    baseline = results[0][1]
+    print(f"recipients: {args.recipients}, templates: {args.templates}, load: {load_ms:.1f} ms")
+    print(f"{'case':<22} {'total ms':>10} {'ns/message':>11} {'vs naive':>9}")
+    for label, elapsed in results:
+        print(f"{label:<22} {elapsed * 1000:>10.1f} {elapsed / args.recipients * 1e9:>11.0f} "
+              f"{elapsed / baseline:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Webhookログエントリのメモリ使用量ベンチマーク（tracemalloc）
+
+従来の dict ベースのログエントリ（リクエストボディ・ヘッダー・source・content を
+そのまま保持）と、WebhookEvent によるコンパクトな表現とで、
+1イベントあたりのメモリ使用量を比較する。
+
+使い方:
+    python benchmarks/webhook_memory.py --events 10000
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook_event import WebhookEvent  # noqa: E402
+
+SAMPLE_HEADERS = {
+    "accept": "*/*",
+    "content-type": "application/json",
+    "host": "example.execute-api.us-east-1.amazonaws.com",
+    "user-agent": "LINE WORKS Bot Server",
+    "x-works-botid": "10207111",
+    "x-works-signature": "c2lnbmF0dXJlLXNhbXBsZS12YWx1ZS1mb3ItYmVuY2htYXJr",
+    "x-amzn-trace-id": "Root=1-65f0c0de-0123456789abcdef01234567",
+    "x-forwarded-for": "203.0.113.10",
+    "x-forwarded-port": "443",
+    "x-forwarded-proto": "https"
+}
+
+
+def sample_body(index):
+    return json.dumps({
+        "type": "message",
+        "source": {
+            "userId": f"user-{index:08d}-0000-0000-0000-000000000000",
+            "channelId": f"channel-{index % 100:04d}",
+            "domainId": 400083023
+        },
+        "issuedTime": "2025-06-11T12:00:00.000Z",
+        "content": {
+            "type": "text",
+            "text": f"こんにちは、メッセージ {index} です"
+        }
+    }, ensure_ascii=False)
+
+
+def legacy_entry(body_str):
+    """変更前の webhook_handler が保持していたログエントリ"""
+    req_body = json.loads(body_str)
+    source = req_body.get('source', {})
+    content = req_body.get('content', {})
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "request_body": req_body,
+        "headers": dict(SAMPLE_HEADERS),
+        "raw_body_exists": True,
+        "body_keys": list(req_body.keys()),
+        "processing_status": "completed",
+        "event_type": req_body.get('type'),
+        "message_info": {
+            "user_id": source.get('userId'),
+            "message_type": content.get('type'),
+            "message_text": content.get('text', ''),
+            "source": source,
+            "content": content
+        }
+    }
+
+
+def compact_entry(body_str, keep_raw):
+    """WebhookEvent を使うログエントリ"""
+    req_body = json.loads(body_str)
+    raw = body_str.encode('utf-8') if keep_raw else None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "event": WebhookEvent.from_body(req_body, raw=raw),
+        "processing_status": "completed"
+    }
+
+
+def measure(build, bodies):
+    """全エントリを保持した状態での確保済みメモリを1件あたりで返す"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    entries = [build(body) for body in bodies]
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(entries)
+    del entries
+    return (after - before) / count, (peak - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhookログエントリのメモリ使用量を比較')
+    parser.add_argument('--events', type=int, default=10000)
+    args = parser.parse_args()
+
+    bodies = [sample_body(i) for i in range(args.events)]
+    cases = [
+        ("legacy dict entry", legacy_entry),
+        ("WebhookEvent (debug log on, raw bytes)", lambda body: compact_entry(body, True)),
+        ("WebhookEvent (debug log off)", lambda body: compact_entry(body, False)),
+    ]
+
+    results = []
+    for name, build in cases:
+        retained, peak = measure(build, bodies)
+        results.append((name, retained, peak))
+
+    baseline = results[0][1]
+    print(f"events: {args.events}")
+    print(f"{'case':<42} {'retained B/event':>17} {'peak B/event':>13} {'vs legacy':>10}")
+    for name, retained, peak in results:
+        print(f"{name:<42} {retained:>17.0f} {peak:>13.0f} {retained / baseline:>9.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""エンドポイント単位のサーキットブレーカー
+
+直近の呼び出しの失敗率がしきい値を超えたらブレーカーを開き、
+一定時間は外部APIを呼ばずに即座に失敗させる（fast-fail）。
+開いてから一定時間が経つと half-open になり、少数のプローブ呼び出しの
+結果で閉じるか再び開くかを決める。
+
+ブレーカーはプロセス（Lambdaコンテナ）単位で保持する。
+"""
+import os
+import threading
+import time
+from collections import deque
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが開いているため呼び出しを行わなかったことを示す例外"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open (retry after {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """失敗率ウィンドウと half-open プローブを持つサーキットブレーカー"""
+
+    def __init__(self, name, failure_rate_threshold=0.5, minimum_calls=5,
+                 window_seconds=60.0, open_seconds=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        # (時刻, 成功したか) の履歴
+        self._calls = deque()
+        self._total_rejected = 0
+        self._last_failure = None
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def _current_state(self, now):
+        # 開いてから open_seconds 経過したら half-open へ遷移
+        if self._state == STATE_OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = STATE_HALF_OPEN
+            self._half_open_in_flight = 0
+        return self._state
+
+    def _open(self, now):
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._half_open_in_flight = 0
+        self._calls.clear()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self):
+        """呼び出し前に実行。ブレーカーが開いていれば CircuitOpenError を送出"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == STATE_OPEN:
+                self._total_rejected += 1
+                raise CircuitOpenError(self.name, self.open_seconds - (now - self._opened_at))
+            if state == STATE_HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    self._total_rejected += 1
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._half_open_in_flight += 1
+
+    def record_success(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._current_state(now) == STATE_HALF_OPEN:
+                # プローブが成功したら閉じる
+                self._state = STATE_CLOSED
+                self._half_open_in_flight = 0
+                self._calls.clear()
+                return
+            self._calls.append((now, True))
+            self._prune(now)
+
+    def record_failure(self, reason=None):
+        now = time.monotonic()
+        with self._lock:
+            self._last_failure = reason
+            if self._current_state(now) == STATE_HALF_OPEN:
+                # プローブが失敗したら再び開く
+                self._open(now)
+                return
+            self._calls.append((now, False))
+            self._prune(now)
+
+            total = len(self._calls)
+            if total >= self.minimum_calls:
+                failures = sum(1 for _, ok in self._calls if not ok)
+                if failures / total >= self.failure_rate_threshold:
+                    self._open(now)
+
+    def snapshot(self):
+        """ヘルスチェック用の状態を返す"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            self._prune(now)
+            total = len(self._calls)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            return {
+                "state": state,
+                "window_calls": total,
+                "window_failures": failures,
+                "failure_rate": round(failures / total, 3) if total else 0.0,
+                "open_remaining_seconds": round(max(0.0, self.open_seconds - (now - self._opened_at)), 1) if state == STATE_OPEN else 0.0,
+                "total_rejected": self._total_rejected,
+                "last_failure": self._last_failure
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """名前付きブレーカーを取得（設定は環境変数から読み込む）"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_rate_threshold=float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5')),
+                    minimum_calls=int(os.environ.get('CIRCUIT_MINIMUM_CALLS', '5')),
+                    window_seconds=float(os.environ.get('CIRCUIT_WINDOW_SECONDS', '60')),
+                    open_seconds=float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def snapshot_all():
+    """すべてのブレーカーの状態を返す"""
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
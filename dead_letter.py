@@ -0,0 +1,435 @@
+"""送信に失敗した返信のデッドレターストアと一括再送（redrive）
+
+Webhook のエコー返信や予約メッセージの送信に失敗した場合、送信リクエスト
+（bot_id / user_id / content）と失敗理由をデッドレターとして保存する。
+障害復旧後は redrive() で保存済みのデッドレターをバッチ単位で、
+レート制限をかけながら再送する。
+
+バックエンドは DEAD_LETTER_BACKEND で選択する。
+
+  sqlite    SQLite（既定、ローカル検証用）
+  file      ローカルディレクトリ（1件1ファイル、ローカル検証用）
+  dynamodb  DynamoDB（DEAD_LETTER_TABLE、boto3 を使用）
+
+Lambda の /tmp はコンテナごとで永続しないため、Lambda では dynamodb を使うこと
+（sqlite / file では障害の間に溜めたデッドレターがコンテナとともに消え、
+再送の呼び出しも別のコンテナに届くと見つからない）。
+
+使い方:
+    python dead_letter.py list
+    python dead_letter.py redrive --batch-size 100 --rate 20
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import outbound
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_REDRIVEN = 'redriven'
+
+
+class SQLiteDeadLetterStore:
+    """デッドレターの永続ストア（SQLite）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get('DEAD_LETTER_PATH', '/tmp/dead_letters.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    request TEXT NOT NULL,
+                    reason TEXT,
+                    source TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_dead_letters_status_id
+                ON dead_letters (status, id)
+            """)
+
+    def add(self, request, reason, source=None):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO dead_letters (request, reason, source, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (json.dumps(request, ensure_ascii=False), str(reason), source, STATUS_PENDING, now, now)
+            )
+            return cursor.lastrowid
+
+    def list_pending(self, limit, after_id=None):
+        """未処理のデッドレターを登録順に返す（after_id より後のもの）"""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, request, reason, source, attempts, created_at
+                FROM dead_letters
+                WHERE status = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (STATUS_PENDING, after_id or 0, limit)
+            ).fetchall()
+        return [{
+            "id": row[0],
+            "request": json.loads(row[1]),
+            "reason": row[2],
+            "source": row[3],
+            "attempts": row[4],
+            "created_at": row[5]
+        } for row in rows]
+
+    def mark_redriven(self, letter_ids):
+        if not letter_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE dead_letters SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(STATUS_REDRIVEN, now, letter_id) for letter_id in letter_ids]
+            )
+
+    def mark_failed(self, letter_id, reason):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE dead_letters SET reason = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (str(reason), time.time(), letter_id)
+            )
+
+    def count_pending(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM dead_letters WHERE status = ?", (STATUS_PENDING,)
+            ).fetchone()[0]
+
+
+class FileDeadLetterStore:
+    """デッドレターの永続ストア（ディレクトリに1件1ファイルのJSON）
+
+    ファイル名は登録時刻順に並ぶIDとし、再送済みのものは削除する。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get('DEAD_LETTER_PATH', '/tmp/dead_letters')
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, letter_id):
+        return os.path.join(self.directory, f"{letter_id}.json")
+
+    def _write(self, record):
+        tmp_path = self._path(record["id"]) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(record["id"]))
+
+    def add(self, request, reason, source=None):
+        now = time.time()
+        letter_id = f"{int(now * 1000000):020d}-{uuid.uuid4().hex[:8]}"
+        self._write({
+            "id": letter_id,
+            "request": request,
+            "reason": str(reason),
+            "source": source,
+            "attempts": 0,
+            "created_at": now
+        })
+        return letter_id
+
+    def list_pending(self, limit, after_id=None):
+        names = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        records = []
+        for letter_id in names:
+            if after_id is not None and letter_id <= after_id:
+                continue
+            try:
+                with open(self._path(letter_id), 'r', encoding='utf-8') as f:
+                    records.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+            if len(records) >= limit:
+                break
+        return records
+
+    def mark_redriven(self, letter_ids):
+        for letter_id in letter_ids:
+            try:
+                os.remove(self._path(letter_id))
+            except FileNotFoundError:
+                pass
+
+    def mark_failed(self, letter_id, reason):
+        with self._lock:
+            try:
+                with open(self._path(letter_id), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return
+            record["reason"] = str(reason)
+            record["attempts"] = record.get("attempts", 0) + 1
+            self._write(record)
+
+    def count_pending(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class DynamoDBDeadLetterStore:
+    """デッドレターの永続ストア（DynamoDB）
+
+    テーブルはパーティションキー id（文字列、登録時刻順に並ぶID）で、status を
+    パーティションキー・id をソートキーとするグローバルセカンダリインデックスを持つこと。
+    再送済みのものは削除する。
+    """
+
+    def __init__(self, table_name=None, index_name=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+        self.table_name = table_name or os.environ['DEAD_LETTER_TABLE']
+        self.index_name = index_name or os.environ.get('DEAD_LETTER_STATUS_INDEX', 'status-id')
+        self._client = client
+
+    def add(self, request, reason, source=None):
+        now = time.time()
+        letter_id = f"{int(now * 1000000):020d}-{uuid.uuid4().hex[:8]}"
+        item = {
+            'id': {'S': letter_id},
+            'request': {'S': json.dumps(request, ensure_ascii=False)},
+            'reason': {'S': str(reason)},
+            'status': {'S': STATUS_PENDING},
+            'attempts': {'N': '0'},
+            'created_at': {'N': repr(now)}
+        }
+        if source:
+            item['source'] = {'S': source}
+        self._client.put_item(TableName=self.table_name, Item=item)
+        return letter_id
+
+    def list_pending(self, limit, after_id=None):
+        """未処理のデッドレターを登録順に返す（after_id より後のもの）"""
+        values = {':status': {'S': STATUS_PENDING}}
+        condition = '#status = :status'
+        if after_id is not None:
+            condition += ' AND id > :after_id'
+            values[':after_id'] = {'S': after_id}
+        kwargs = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': condition,
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': values
+        }
+        records = []
+        while len(records) < limit:
+            response = self._client.query(Limit=limit - len(records), **kwargs)
+            for item in response.get('Items', []):
+                records.append({
+                    "id": item['id']['S'],
+                    "request": json.loads(item['request']['S']),
+                    "reason": item['reason']['S'] if 'reason' in item else None,
+                    "source": item['source']['S'] if 'source' in item else None,
+                    "attempts": int(item['attempts']['N']),
+                    "created_at": float(item['created_at']['N'])
+                })
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return records
+
+    def mark_redriven(self, letter_ids):
+        for letter_id in letter_ids:
+            self._client.delete_item(TableName=self.table_name, Key={'id': {'S': letter_id}})
+
+    def mark_failed(self, letter_id, reason):
+        try:
+            self._client.update_item(
+                TableName=self.table_name,
+                Key={'id': {'S': letter_id}},
+                UpdateExpression='SET reason = :reason, attempts = attempts + :one',
+                ConditionExpression='attribute_exists(id)',
+                ExpressionAttributeValues={':reason': {'S': str(reason)}, ':one': {'N': '1'}}
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def count_pending(self):
+        kwargs = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': '#status = :status',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':status': {'S': STATUS_PENDING}},
+            'Select': 'COUNT'
+        }
+        count = 0
+        while True:
+            response = self._client.query(**kwargs)
+            count += response.get('Count', 0)
+            if 'LastEvaluatedKey' not in response:
+                return count
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def redrive(store, send_func, batch_size=100, rate_per_second=10.0, max_items=None, progress=None,
+            deadline=None, concurrency=8):
+    """デッドレターをバッチ単位で再送する
+
+    send_func(request) は (成功したか, エラー内容) を返すこと。
+    バッチ内のデッドレターは concurrency 件まで並行して再送し、送信の開始は
+    RateLimiter で rate_per_second 件/秒に制限する（1件ずつのレイテンシで頭打ちにならない）。
+    progress が指定されていれば、バッチごとに集計結果を渡して呼び出す。
+    再送に成功したデッドレターはその都度削除するため、途中で打ち切られても二重送信にならない。
+    deadline（time.monotonic() の値）を過ぎたら次の再送を始めずに終了する（残りは次回）。
+    """
+    limiter = outbound.RateLimiter(rate_per_second)
+    summary = {"processed": 0, "redriven": 0, "failed": 0, "batches": 0, "remaining": None,
+               "stopped_at_deadline": False}
+    started = time.monotonic()
+    after_id = None
+
+    def expired():
+        return deadline is not None and time.monotonic() >= deadline
+
+    def send(letter):
+        limiter.acquire()
+        if expired():
+            return letter, None, None
+        try:
+            ok, error = send_func(letter["request"])
+        except Exception as e:
+            ok, error = False, str(e)
+        return letter, ok, error
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        while max_items is None or summary["processed"] < max_items:
+            if expired():
+                summary["stopped_at_deadline"] = True
+                break
+            limit = batch_size if max_items is None else min(batch_size, max_items - summary["processed"])
+            letters = store.list_pending(limit, after_id=after_id)
+            if not letters:
+                break
+            summary["batches"] += 1
+            after_id = letters[-1]["id"]
+
+            futures = [executor.submit(send, letter) for letter in letters]
+            for future in as_completed(futures):
+                letter, ok, error = future.result()
+                if ok is None:
+                    # 締め切りを過ぎたので送らずに残す
+                    summary["stopped_at_deadline"] = True
+                    continue
+                if ok:
+                    store.mark_redriven([letter["id"]])
+                    summary["redriven"] += 1
+                else:
+                    store.mark_failed(letter["id"], error)
+                    summary["failed"] += 1
+                summary["processed"] += 1
+
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Redrive progress: batch {summary['batches']}, processed {summary['processed']}, "
+                f"redriven {summary['redriven']}, failed {summary['failed']} ({elapsed:.1f}s)"
+            )
+            if progress is not None:
+                progress(dict(summary, elapsed_seconds=round(elapsed, 1)))
+            if summary["stopped_at_deadline"]:
+                break
+
+    summary["remaining"] = store.count_pending()
+    summary["elapsed_seconds"] = round(time.monotonic() - started, 1)
+    return summary
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    """DEAD_LETTER_BACKEND（sqlite / file / dynamodb）に応じたストアを取得"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                backend = os.environ.get('DEAD_LETTER_BACKEND', 'sqlite')
+                if backend == 'dynamodb':
+                    _default_store = DynamoDBDeadLetterStore()
+                else:
+                    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+                        logger.warning(f"DEAD_LETTER_BACKEND={backend} is local to this Lambda container; "
+                                       "use dynamodb in production")
+                    if backend == 'file':
+                        _default_store = FileDeadLetterStore()
+                    else:
+                        _default_store = SQLiteDeadLetterStore()
+    return _default_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='デッドレターの確認と一括再送')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='未処理のデッドレターを表示')
+    list_parser.add_argument('--limit', type=int, default=20)
+
+    redrive_parser = subparsers.add_parser('redrive', help='デッドレターを再送')
+    redrive_parser.add_argument('--batch-size', type=int, default=100)
+    redrive_parser.add_argument('--rate', type=float, default=10.0, help='1秒あたりの最大送信数')
+    redrive_parser.add_argument('--max-items', type=int, default=None)
+    redrive_parser.add_argument('--concurrency', type=int, default=8, help='並行して再送する数')
+    args = parser.parse_args(argv)
+
+    store = get_store()
+    if args.command == 'list':
+        print(f"Pending dead letters: {store.count_pending()}")
+        for letter in store.list_pending(args.limit):
+            print(json.dumps(letter, ensure_ascii=False))
+        return 0
+
+    # 送信処理は Lambda 関数と同じものを使う
+    import lambda_function
+
+    def print_progress(summary):
+        print(f"batch {summary['batches']}: processed {summary['processed']}, "
+              f"redriven {summary['redriven']}, failed {summary['failed']}")
+
+    summary = redrive(
+        store,
+        lambda_function.send_dead_letter_request,
+        batch_size=args.batch_size,
+        rate_per_second=args.rate,
+        max_items=args.max_items,
+        concurrency=args.concurrency,
+        progress=print_progress
+    )
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -1,26 +1,116 @@
 import azure.functions as func
 import logging
 import json
-import requests
+import gzip
+import uuid
+import threading
 import jwt
 import time
-import os
 from datetime import datetime, timedelta
 
+import adaptive_limiter
+import circuit_breaker
+import http_client
+import message_templates
+import scheduler
+import settings
+import token_store
+from webhook_event import WebhookEvent
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
+# 起動時に設定を読み込んで検証（不正な値はワーカーの初期化時に検出する）
+settings.get_settings()
+
 # 受信したユーザーIDを記録するためのグローバル変数（実運用では永続化ストレージを使用）
 received_user_ids = set()
 
 # Webhookログを保存するためのグローバル変数（実運用では永続化ストレージを使用）
 webhook_logs = []
 
+# 管理用ルートのレスポンスキャッシュ用。ストアを更新するたびにバージョンを進める
+_store_versions = {"webhook_logs": 0, "received_users": 0}
+
+# シリアライズ済みレスポンスのキャッシュ（(ストア名, バリアント) -> (バージョン, ETag, 本文, gzip本文)）
+_response_cache = {}
+
+# バージョンの更新とキャッシュの差し替えを守るロック（シリアライズと圧縮はロックの外で行う）
+_cache_lock = threading.Lock()
+
+# ワーカー再起動でバージョンが巻き戻ってもETagが衝突しないようにするための識別子
+_instance_id = uuid.uuid4().hex[:8]
+
+# この長さ以上のレスポンスは gzip 圧縮する（クライアントが対応している場合）
+GZIP_MIN_BYTES = 1024
+
+def mark_store_changed(store_name):
+    """ストアの更新を記録し、キャッシュ済みレスポンスを無効化"""
+    with _cache_lock:
+        _store_versions[store_name] += 1
+
+def cached_json_response(req, store_name, variant, build_payload, indent=None):
+    """ストアのバージョンをETagとしたJSONレスポンスを返す
+
+    If-None-Match が一致すれば 304 を返し、バージョンが変わるまでは
+    シリアライズ済みの本文を使い回す。gzip で返す場合は別の表現として ETag を分ける。
+    """
+    cache_key = (store_name, variant)
+    with _cache_lock:
+        version = _store_versions[store_name]
+        cached = _response_cache.get(cache_key)
+    
+    if cached is None or cached[0] != version:
+        # バージョンを先に読んでいるので、本文はそのバージョン以降の内容になる
+        etag = f'"{store_name}-{_instance_id}-{version}-{abs(hash(variant)):x}"'
+        body = json.dumps(
+            build_payload(),
+            ensure_ascii=False,
+            indent=indent,
+            separators=None if indent else (',', ':')
+        ).encode('utf-8')
+        cached = (version, etag, body, None)
+        with _cache_lock:
+            # 並行して作られた新しいバージョンのキャッシュを古いもので上書きしない
+            current = _response_cache.get(cache_key)
+            if current is None or current[0] < version:
+                _response_cache[cache_key] = cached
+    
+    version, etag, body, gzip_body = cached
+    accept_encoding = req.headers.get('accept-encoding') or ''
+    use_gzip = 'gzip' in accept_encoding.lower() and len(body) >= GZIP_MIN_BYTES
+    if use_gzip:
+        etag = f'{etag[:-1]}-gzip"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    
+    if_none_match = req.headers.get('if-none-match')
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in candidates or etag in candidates or f'W/{etag}' in candidates:
+            return func.HttpResponse(status_code=304, headers=headers)
+    
+    if use_gzip:
+        if gzip_body is None:
+            gzip_body = gzip.compress(body, compresslevel=6)
+            with _cache_lock:
+                current = _response_cache.get(cache_key)
+                if current is not None and current[0] == version and current[3] is None:
+                    _response_cache[cache_key] = (version, current[1], body, gzip_body)
+        headers['Content-Encoding'] = 'gzip'
+        return func.HttpResponse(gzip_body, status_code=200, headers=headers, mimetype="application/json")
+    
+    return func.HttpResponse(body, status_code=200, headers=headers, mimetype="application/json")
+
 def generate_jwt_token():
     """LINE WORKS API用のJWTトークンを生成（Service Account認証）"""
     try:
-        client_id = os.environ.get('LINEWORKS_CLIENT_ID')
-        service_account_id = os.environ.get('LINEWORKS_SERVICE_ACCOUNT_ID')
-        private_key = os.environ.get('LINEWORKS_PRIVATE_KEY')
+        config = settings.get_settings()
+        client_id = config.client_id
+        service_account_id = config.service_account_id
+        private_key = config.private_key
         
         if not all([client_id, service_account_id, private_key]):
             raise ValueError("Missing required environment variables: LINEWORKS_CLIENT_ID, LINEWORKS_SERVICE_ACCOUNT_ID, LINEWORKS_PRIVATE_KEY")
@@ -53,52 +143,88 @@ def generate_jwt_token():
         logging.error(f"JWT token generation failed: {str(e)}")
         return None
 
-def get_access_token():
-    """アクセストークンを取得（Service Account認証）"""
-    try:
-        jwt_token = generate_jwt_token()
-        if not jwt_token:
-            return None
-            
-        client_id = os.environ.get('LINEWORKS_CLIENT_ID')
-        client_secret = os.environ.get('LINEWORKS_CLIENT_SECRET')
-        
-        if not all([client_id, client_secret]):
-            raise ValueError("Missing required environment variables: LINEWORKS_CLIENT_ID, LINEWORKS_CLIENT_SECRET")
-            
-        # LINE WORKS API 2.0 トークンエンドポイント（公式仕様）
-        url = "https://auth.worksmobile.com/oauth2/v2.0/token"
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
+def fetch_access_token():
+    """トークンエンドポイントからアクセストークンを発行（Service Account認証）
+
+    access_token / fetched_at / expires_at の dict を返す（発行に失敗した場合は None）。
+    """
+    jwt_token = generate_jwt_token()
+    if not jwt_token:
+        return None
         
-        # Service Account認証用のパラメータ（公式仕様）
-        data = {
-            'assertion': jwt_token,
-            'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'scope': 'bot'  # Bot APIスコープ
+    config = settings.get_settings()
+    client_id = config.client_id
+    client_secret = config.client_secret
+    
+    if not all([client_id, client_secret]):
+        raise ValueError("Missing required environment variables: LINEWORKS_CLIENT_ID, LINEWORKS_CLIENT_SECRET")
+        
+    # LINE WORKS API 2.0 トークンエンドポイント（公式仕様）
+    url = f"{http_client.AUTH_BASE_URL}/oauth2/v2.0/token"
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }
+    
+    # Service Account認証用のパラメータ（公式仕様）
+    data = {
+        'assertion': jwt_token,
+        'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+        'client_id': client_id,
+        'client_secret': client_secret,
+        'scope': 'bot'  # Bot APIスコープ
+    }
+    
+    logging.info(f"Requesting access token from: {url}")
+    response = http_client.post(http_client.AUTH_ENDPOINT, url, headers=headers, data=data)
+    
+    if response.status_code in [200, 201]:
+        token_data = response.json()
+        access_token = token_data.get('access_token')
+        expires_in = token_data.get('expires_in', 3600)
+        logging.info(f"Access token acquired successfully. Expires in: {expires_in} seconds")
+        fetched_at = time.time()
+        return {
+            'access_token': access_token,
+            'fetched_at': fetched_at,
+            'expires_at': fetched_at + int(expires_in)
         }
-        
-        logging.info(f"Requesting access token from: {url}")
-        response = requests.post(url, headers=headers, data=data)
-        
-        if response.status_code in [200, 201]:
-            token_data = response.json()
-            access_token = token_data.get('access_token')
-            expires_in = token_data.get('expires_in', 3600)
-            refresh_token = token_data.get('refresh_token')
-            logging.info(f"Access token acquired successfully. Expires in: {expires_in} seconds")
-            return access_token
-        else:
-            logging.error(f"Access token request failed: {response.status_code} - {response.text}")
-            return None
+    else:
+        logging.error(f"Access token request failed: {response.status_code} - {response.text}")
+        return None
+
+def get_access_token():
+    """アクセストークンを取得（ワーカー間で共有するキャッシュを使用）"""
+    try:
+        token = token_store.get_token_cache().get_token(fetch_access_token)
+        return token['access_token'] if token else None
             
+    except circuit_breaker.CircuitOpenError:
+        # ブレーカーが開いている場合は呼び出し元で fast-fail させる
+        logging.warning("Token endpoint circuit is open, skipping token request")
+        raise
     except Exception as e:
         logging.error(f"Access token acquisition failed: {str(e)}")
         return None
 
+def send_bot_message(bot_id, user_id, content, access_token, lane=adaptive_limiter.LANE_TRANSACTIONAL):
+    """Botからユーザーへメッセージを送信し、APIのレスポンスを返す（lane は送信レーン）"""
+    url = f"{http_client.API_BASE_URL}/v1.0/bots/{bot_id}/users/{user_id}/messages"
+    
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    
+    message_data = {
+        "content": content
+    }
+    
+    response = http_client.post(http_client.API_ENDPOINT, url, lane=lane, headers=headers, json=message_data)
+    if response.status_code == 401:
+        # トークンが失効している場合は共有キャッシュから破棄して次回の呼び出しで再発行させる
+        token_store.get_token_cache().invalidate(access_token)
+    return response
+
 @app.route(route="send_message", methods=["POST"])
 def send_message(req: func.HttpRequest) -> func.HttpResponse:
     """LINE WORKS Botでメッセージを送信"""
@@ -115,7 +241,7 @@ def send_message(req: func.HttpRequest) -> func.HttpResponse:
             )
         
         # Bot IDは環境変数から取得（デフォルト値として設定済み）
-        bot_id = req_body.get('bot_id') or os.environ.get('LINEWORKS_BOT_ID', '10207111')
+        bot_id = req_body.get('bot_id') or settings.get_settings().bot_id
         user_id = req_body.get('user_id')
         message_text = req_body.get('message', 'Hello from Azure Functions!')
         
@@ -136,22 +262,7 @@ def send_message(req: func.HttpRequest) -> func.HttpResponse:
             )
         
         # メッセージ送信API呼び出し
-        domain_id = os.environ.get('LINEWORKS_DOMAIN_ID')
-        url = f"https://www.worksapis.com/v1.0/bots/{bot_id}/users/{user_id}/messages"
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        message_data = {
-            "content": {
-                "type": "text",
-                "text": message_text
-            }
-        }
-        
-        response = requests.post(url, headers=headers, json=message_data)
+        response = send_bot_message(bot_id, user_id, {"type": "text", "text": message_text}, access_token)
         
         if response.status_code == 200:
             return func.HttpResponse(
@@ -175,6 +286,18 @@ def send_message(req: func.HttpRequest) -> func.HttpResponse:
                 mimetype="application/json"
             )
             
+    except circuit_breaker.CircuitOpenError as e:
+        logging.error(f"Message send rejected: {str(e)}")
+        return func.HttpResponse(
+            json.dumps({
+                "error": "LINE WORKS API is temporarily unavailable",
+                "circuit": e.name,
+                "retry_after": round(e.retry_after, 1)
+            }),
+            status_code=503,
+            headers={'Retry-After': str(max(1, int(e.retry_after)))},
+            mimetype="application/json"
+        )
     except Exception as e:
         logging.error(f"Function execution failed: {str(e)}")
         return func.HttpResponse(
@@ -188,11 +311,17 @@ def health_check(req: func.HttpRequest) -> func.HttpResponse:
     """ヘルスチェック用エンドポイント"""
     logging.info('Health check function processed a request.')
     
+    # いずれかのブレーカーが閉じていなければ degraded として報告
+    breakers = circuit_breaker.snapshot_all()
+    status = "degraded" if any(b["state"] != circuit_breaker.STATE_CLOSED for b in breakers.values()) else "healthy"
+    
     return func.HttpResponse(
         json.dumps({
-            "status": "healthy",
+            "status": status,
             "timestamp": datetime.now().isoformat(),
-            "version": "1.0.0"
+            "version": "1.0.0",
+            "circuit_breakers": breakers,
+            "concurrency_limits": adaptive_limiter.snapshot_all()
         }),
         status_code=200,
         mimetype="application/json"
@@ -207,15 +336,16 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
         # リクエストボディを取得
         req_body = req.get_json()
         
-        # 詳細なWebhookログを作成
+        # 処理に使うフィールドだけを取り出したコンパクトなイベント（生のボディはデバッグログ有効時のみ保持）
+        debug_log = settings.get_settings().webhook_debug_log
+        webhook_event = WebhookEvent.from_body(req_body, raw=req.get_body() if debug_log else None)
+        
+        # Webhookログを作成（ボディ全体・ヘッダーは保持しない）
         webhook_log_entry = {
             "timestamp": datetime.now().isoformat(),
-            "request_body": req_body,
-            "headers": {key: value for key, value in req.headers.items()},
+            "event": webhook_event,
             "content_type": req.headers.get('content-type'),
             "user_agent": req.headers.get('user-agent'),
-            "raw_body_exists": req_body is not None,
-            "body_keys": list(req_body.keys()) if req_body else [],
             "processing_status": "started"
         }
         
@@ -223,9 +353,11 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
         webhook_logs.append(webhook_log_entry)
         if len(webhook_logs) > 10:
             webhook_logs.pop(0)
+        mark_store_changed("webhook_logs")
         
         if not req_body:
             webhook_log_entry["processing_status"] = "empty_body"
+            mark_store_changed("webhook_logs")
             logging.warning("Empty request body received")
             return func.HttpResponse("OK", status_code=200)
         
@@ -237,42 +369,32 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
         logging.info(f"Request headers: {json.dumps(headers_dict, indent=2, ensure_ascii=False)}")
         
         # イベントタイプを確認
-        event_type = req_body.get('type')
+        event_type = webhook_event.type
         logging.info(f"Event type: {event_type}")
         
         # すべてのキーを確認（デバッグ用）
         logging.info(f"All keys in request: {list(req_body.keys())}")
         
         # ログエントリにイベント情報を追加
-        webhook_log_entry["event_type"] = event_type
         webhook_log_entry["processing_status"] = "analyzing"
         
         # メッセージイベントの場合
         if event_type == 'message':
             # メッセージ情報を抽出
-            source = req_body.get('source', {})
-            content = req_body.get('content', {})  # LINE WORKSでは'content'キーを使用
-            
-            user_id = source.get('userId')
-            message_type = content.get('type')
-            message_text = content.get('text', '')
+            user_id = webhook_event.user_id
+            message_type = webhook_event.content_type
+            message_text = webhook_event.text or ''
             
             # 受信したユーザーIDを記録
             if user_id:
-                received_user_ids.add(user_id)
+                if user_id not in received_user_ids:
+                    received_user_ids.add(user_id)
+                    mark_store_changed("received_users")
                 logging.info(f"Added user ID to collection: {user_id}")
             
             logging.info(f"Message from user {user_id}: {message_text}")
             logging.info(f"Total unique users received: {len(received_user_ids)}")
             
-            # ログエントリにメッセージ情報を追加
-            webhook_log_entry["message_info"] = {
-                "user_id": user_id,
-                "message_type": message_type,
-                "message_text": message_text,
-                "source": source,
-                "content": content
-            }
             webhook_log_entry["processing_status"] = "message_parsed"
             
             # テキストメッセージの場合、エコー返信
@@ -280,7 +402,7 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
                 logging.info(f"Processing text message from user {user_id}: '{message_text}'")
                 
                 # 既存のsend_message機能を使ってエコー返信
-                echo_message = f"受信しました: {message_text}"
+                echo_message = message_templates.render("echo", {"text": message_text})
                 
                 # アクセストークン取得
                 logging.info("Getting access token...")
@@ -289,25 +411,14 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
                     logging.info("Access token acquired successfully")
                     
                     # メッセージ送信
-                    bot_id = os.environ.get('LINEWORKS_BOT_ID', '10207111')
-                    url = f"https://www.worksapis.com/v1.0/bots/{bot_id}/users/{user_id}/messages"
-                    
-                    headers = {
-                        'Authorization': f'Bearer {access_token}',
-                        'Content-Type': 'application/json'
-                    }
-                    
-                    message_data = {
-                        "content": {
-                            "type": "text",
-                            "text": echo_message
-                        }
-                    }
+                    bot_id = settings.get_settings().bot_id
+                    echo_content = {"type": "text", "text": echo_message}
                     
-                    logging.info(f"Sending echo message to {url}")
-                    logging.info(f"Message data: {json.dumps(message_data, ensure_ascii=False)}")
+                    logging.info(f"Sending echo message to user {user_id} via bot {bot_id}")
+                    logging.info(f"Message data: {json.dumps({'content': echo_content}, ensure_ascii=False)}")
                     
-                    response = requests.post(url, headers=headers, json=message_data)
+                    response = send_bot_message(bot_id, user_id, echo_content, access_token,
+                                                lane=adaptive_limiter.LANE_INTERACTIVE)
                     
                     logging.info(f"Response status: {response.status_code}")
                     logging.info(f"Response headers: {dict(response.headers)}")
@@ -362,6 +473,7 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
         # 処理完了をログに記録
         webhook_log_entry["processing_status"] = "completed"
         webhook_log_entry["completion_time"] = datetime.now().isoformat()
+        mark_store_changed("webhook_logs")
         
         # Webhook応答（必ず200を返す）
         return func.HttpResponse("OK", status_code=200)
@@ -374,38 +486,38 @@ def webhook_receiver(req: func.HttpRequest) -> func.HttpResponse:
             webhook_log_entry["processing_status"] = "error"
             webhook_log_entry["error"] = str(e)
             webhook_log_entry["completion_time"] = datetime.now().isoformat()
+            mark_store_changed("webhook_logs")
         
         # エラーが発生してもLINE WORKSには200を返す
         return func.HttpResponse("OK", status_code=200)
 
 @app.route(route="webhook_logs", methods=["GET"])
 def get_webhook_logs(req: func.HttpRequest) -> func.HttpResponse:
-    """Webhookの詳細ログを取得"""
+    """Webhookの詳細ログを取得（ETag対応。?pretty=1 で整形出力）"""
     logging.info('Get webhook logs function processed a request.')
     
     try:
         # クエリパラメータで件数制限
         limit = req.params.get('limit')
-        if limit:
-            try:
-                limit = int(limit)
-                logs_to_return = webhook_logs[-limit:] if limit > 0 else webhook_logs
-            except ValueError:
-                logs_to_return = webhook_logs
-        else:
-            logs_to_return = webhook_logs
-        
-        return func.HttpResponse(
-            json.dumps({
+        try:
+            limit = int(limit) if limit else 0
+        except ValueError:
+            limit = 0
+        pretty = req.params.get('pretty') in ('1', 'true')
+        
+        def build_payload():
+            logs_to_return = webhook_logs[-limit:] if limit > 0 else webhook_logs
+            return {
                 "success": True,
-                "webhook_logs": logs_to_return,
+                "webhook_logs": [
+                    {**entry, "event": entry["event"].to_log_dict()} for entry in logs_to_return
+                ],
                 "total_count": len(webhook_logs),
                 "returned_count": len(logs_to_return),
                 "timestamp": datetime.now().isoformat()
-            }, ensure_ascii=False, indent=2),
-            status_code=200,
-            mimetype="application/json"
-        )
+            }
+        
+        return cached_json_response(req, "webhook_logs", (limit, pretty), build_payload, indent=2 if pretty else None)
     except Exception as e:
         logging.error(f"Get webhook logs function failed: {str(e)}")
         return func.HttpResponse(
@@ -416,20 +528,19 @@ def get_webhook_logs(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.route(route="received_users", methods=["GET"])
 def get_received_users(req: func.HttpRequest) -> func.HttpResponse:
-    """Webhookで受信したユーザーID一覧を取得"""
+    """Webhookで受信したユーザーID一覧を取得（ETag対応）"""
     logging.info('Get received users function processed a request.')
     
     try:
-        return func.HttpResponse(
-            json.dumps({
+        def build_payload():
+            return {
                 "success": True,
                 "received_user_ids": list(received_user_ids),
                 "total_count": len(received_user_ids),
                 "timestamp": datetime.now().isoformat()
-            }, ensure_ascii=False),
-            status_code=200,
-            mimetype="application/json"
-        )
+            }
+        
+        return cached_json_response(req, "received_users", None, build_payload)
     except Exception as e:
         logging.error(f"Get received users function failed: {str(e)}")
         return func.HttpResponse(
@@ -454,8 +565,8 @@ def get_users(req: func.HttpRequest) -> func.HttpResponse:
             )
         
         # ユーザー一覧取得API呼び出し
-        domain_id = os.environ.get('LINEWORKS_DOMAIN_ID')
-        url = f"https://www.worksapis.com/v1.0/users"
+        domain_id = settings.get_settings().domain_id
+        url = f"{http_client.API_BASE_URL}/v1.0/users"
         
         headers = {
             'Authorization': f'Bearer {access_token}',
@@ -468,7 +579,7 @@ def get_users(req: func.HttpRequest) -> func.HttpResponse:
         }
         
         logging.info(f"Requesting users from: {url}")
-        response = requests.get(url, headers=headers, params=params)
+        response = http_client.get(http_client.API_ENDPOINT, url, headers=headers, params=params)
         
         logging.info(f"Response status: {response.status_code}")
         logging.info(f"Response body: {response.text}")
@@ -503,25 +614,121 @@ def get_users(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
+@app.route(route="schedule_message", methods=["POST"])
+def schedule_message(req: func.HttpRequest) -> func.HttpResponse:
+    """メッセージを指定時刻に送信するよう予約"""
+    logging.info('Schedule message function processed a request.')
+    
+    try:
+        try:
+            req_body = req.get_json()
+        except ValueError as e:
+            return func.HttpResponse(
+                json.dumps({"error": f"JSON decode error: {str(e)}"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        
+        req_body = req_body or {}
+        user_id = req_body.get('user_id')
+        message_text = req_body.get('message')
+        bot_id = req_body.get('bot_id')
+        
+        if not user_id or not message_text:
+            return func.HttpResponse(
+                json.dumps({"error": "user_id and message are required"}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        
+        # 送信時刻は send_at（Unix時間 / ISO 8601）または delay_seconds で指定
+        try:
+            if req_body.get('delay_seconds') is not None:
+                send_at = time.time() + float(req_body['delay_seconds'])
+            else:
+                send_at = scheduler.parse_send_at(req_body.get('send_at'))
+        except (TypeError, ValueError) as e:
+            return func.HttpResponse(
+                json.dumps({"error": str(e)}),
+                status_code=400,
+                mimetype="application/json"
+            )
+        
+        message_id = scheduler.get_store().enqueue(user_id, message_text, send_at, bot_id=bot_id)
+        logging.info(f"Scheduled message {message_id} for user {user_id} at {send_at}")
+        
+        return func.HttpResponse(
+            json.dumps({
+                "success": True,
+                "id": message_id,
+                "send_at": datetime.fromtimestamp(send_at).isoformat(),
+                "timestamp": datetime.now().isoformat()
+            }),
+            status_code=200,
+            mimetype="application/json"
+        )
+        
+    except Exception as e:
+        logging.error(f"Schedule message function failed: {str(e)}")
+        return func.HttpResponse(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status_code=500,
+            mimetype="application/json"
+        )
+
+@app.timer_trigger(schedule="0 */1 * * * *", arg_name="timer", run_on_startup=False, use_monitor=False)
+def scheduler_tick(timer: func.TimerRequest) -> None:
+    """期限到来した予約メッセージを送信（1分ごとのTimer Trigger）"""
+    logging.info('Scheduler tick function processed a request.')
+    
+    store = scheduler.get_store()
+    config = settings.get_settings()
+    default_bot_id = config.bot_id
+    token_holder = {}
+    token_lock = threading.Lock()
+    
+    def send_item(item):
+        # アクセストークンは最初の送信時に1回だけ取得してtick内で使い回す（送信は並行して行う）
+        with token_lock:
+            if 'access_token' not in token_holder:
+                token_holder['access_token'] = get_access_token()
+        access_token = token_holder['access_token']
+        if not access_token:
+            return False, "Failed to get access token"
+        
+        response = send_bot_message(item['bot_id'] or default_bot_id, item['user_id'], item['content'], access_token)
+        if response.status_code in [200, 201]:
+            return True, None
+        return False, f"{response.status_code} - {response.text}"
+    
+    scheduler.run_tick(
+        store,
+        send_item,
+        batch_size=config.scheduler_batch_size,
+        max_batches=config.scheduler_max_batches
+    )
+
 @app.route(route="test", methods=["GET"])
 def test_function(req: func.HttpRequest) -> func.HttpResponse:
     """テスト用の簡単な関数"""
     logging.info('Test function processed a request.')
     
     name = req.params.get('name', 'World')
+    config = settings.get_settings()
     
     return func.HttpResponse(
         json.dumps({
             "message": f"Hello, {name}!",
             "timestamp": datetime.now().isoformat(),
             "env_check": {
-                "has_client_id": bool(os.environ.get('LINEWORKS_CLIENT_ID')),
-                "has_client_secret": bool(os.environ.get('LINEWORKS_CLIENT_SECRET')),
-                "has_service_account_id": bool(os.environ.get('LINEWORKS_SERVICE_ACCOUNT_ID')),
-                "has_private_key": bool(os.environ.get('LINEWORKS_PRIVATE_KEY')),
-                "has_domain_id": bool(os.environ.get('LINEWORKS_DOMAIN_ID')),
-                "has_bot_id": bool(os.environ.get('LINEWORKS_BOT_ID'))
-            }
+                "has_client_id": bool(config.client_id),
+                "has_client_secret": bool(config.client_secret),
+                "has_service_account_id": bool(config.service_account_id),
+                "has_private_key": bool(config.private_key),
+                "has_domain_id": bool(config.domain_id),
+                "has_bot_id": config.has_bot_id
+            },
+            "secrets_source": config.secrets_source
         }),
         status_code=200,
         mimetype="application/json"
@@ -0,0 +1,138 @@
+"""LINE WORKS API 呼び出し用のHTTPクライアント
+
+すべての外部呼び出しにタイムアウトを付け、呼び出し先（トークン発行 /
+Bot API）ごとのサーキットブレーカーを通す。Bot API への同時リクエスト数は
+レイテンシに応じて調整するリミッターで制限し、空いた枠は送信レーン
+（interactive / transactional / bulk）の優先度に応じて割り当てる。接続はプロセス内で共有する
+requests.Session のコネクションプールを再利用する。
+"""
+import os
+import time
+
+import requests
+import requests.adapters
+
+import adaptive_limiter
+import circuit_breaker
+import settings
+
+# ブレーカー名（エンドポイント単位）
+AUTH_ENDPOINT = 'auth.worksmobile.com'
+API_ENDPOINT = 'www.worksapis.com'
+
+# 接続先のベースURL（ローカルのAPIスタブに向ける場合は環境変数で上書き）
+AUTH_BASE_URL = os.environ.get('LINEWORKS_AUTH_BASE_URL', 'https://auth.worksmobile.com').rstrip('/')
+API_BASE_URL = os.environ.get('LINEWORKS_API_BASE_URL', 'https://www.worksapis.com').rstrip('/')
+
+_session = requests.Session()
+
+# 同時実行数の上限（ADAPTIVE_MAX_LIMIT）までの接続をプールに保持できるようにする
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.environ.get('HTTP_POOL_MAXSIZE', '32'))
+)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+
+def get_timeout():
+    """(接続タイムアウト, 読み取りタイムアウト) を返す（起動時に読み込んだ設定の値）"""
+    config = settings.get_settings()
+    return (config.http_connect_timeout, config.http_read_timeout)
+
+
+def request(endpoint, method, url, lane=None, **kwargs):
+    """ブレーカーを通してリクエストを送信
+
+    ブレーカーが開いている場合は通信せずに CircuitOpenError を送出する。
+    接続エラー・タイムアウト・5xx・429 を失敗として数える。
+    lane は Bot API の送信レーン（adaptive_limiter.LANE_*、省略時は transactional）。
+    """
+    breaker = circuit_breaker.get_breaker(endpoint)
+    breaker.before_call()
+
+    # Bot API はレイテンシに応じて同時実行数を制限（枠はレーンの優先度に応じて割り当て）
+    limiter = adaptive_limiter.get_limiter(endpoint) if endpoint == API_ENDPOINT else None
+    started = None
+    response = None
+    failure = "request aborted"
+    kwargs.setdefault('timeout', get_timeout())
+    try:
+        if limiter is not None:
+            started = limiter.acquire(lane)
+        response = _session.request(method, url, **kwargs)
+        if response.status_code >= 500 or response.status_code == 429:
+            failure = f"HTTP {response.status_code}"
+        else:
+            failure = None
+        return response
+    except Exception as e:
+        failure = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        # 例外の種類にかかわらず、リミッターの枠を返してブレーカーに結果を記録する
+        if started is not None:
+            if response is not None:
+                limiter.release(started, status_code=response.status_code, lane=lane)
+            else:
+                limiter.release(started, error=True, lane=lane)
+        if failure is None:
+            breaker.record_success()
+        else:
+            breaker.record_failure(failure)
+
+
+def post(endpoint, url, **kwargs):
+    return request(endpoint, 'POST', url, **kwargs)
+
+
+def get(endpoint, url, **kwargs):
+    return request(endpoint, 'GET', url, **kwargs)
+
+
+def pool_stats():
+    """コネクションプールの状態（ホストごとの接続数・リクエスト数）を返す"""
+    adapter = _session.get_adapter(API_BASE_URL)
+    pools = {}
+    for key in list(adapter.poolmanager.pools.keys()):
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is None:
+            continue
+        pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+            "connections_created": pool.num_connections,
+            "requests": pool.num_requests,
+            "idle_connections": pool.pool.qsize() if pool.pool is not None else 0
+        }
+    return {
+        "pool_maxsize": adapter._pool_maxsize,
+        "pools": pools
+    }
+
+
+def probe(url):
+    """疎通確認用の軽量リクエスト（HEAD）を送りレイテンシを測定
+
+    ブレーカーの集計には含めない。HTTPレスポンスが返れば到達可能とみなす。
+    """
+    started = time.perf_counter()
+    try:
+        response = _session.head(url, timeout=get_timeout(), allow_redirects=False)
+        return {
+            "reachable": True,
+            "status_code": response.status_code,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+    except requests.RequestException as e:
+        return {
+            "reachable": False,
+            "error": f"{type(e).__name__}: {str(e)}",
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+
+def warm_connections():
+    """トークン発行 / Bot API の両ホストへ接続を張り、プールに残しておく"""
+    return {
+        AUTH_ENDPOINT: probe(f"{AUTH_BASE_URL}/"),
+        API_ENDPOINT: probe(f"{API_BASE_URL}/")
+    }
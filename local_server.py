@@ -0,0 +1,214 @@
+"""Lambda ハンドラーをローカルで動かす開発用HTTPサーバー
+
+受け取ったHTTPリクエストを API Gateway のプロキシイベントに変換して
+lambda_handler を呼び出す。並行実行のモードは次の2つ:
+
+  thread   1プロセス内のスレッドで並行実行（モジュールのグローバル変数を共有）
+  process  ワーカープロセスごとに lambda_function を読み込み並行実行
+           （Lambda のコンテナと同様にグローバル変数が分離される）
+
+--stub を付けると LINE WORKS API のスタブ（local_stub.py）を起動し、
+外部への送信をすべてスタブに向ける。
+
+使い方:
+    python local_server.py --port 3000 --mode process --concurrency 4 --stub
+    curl -X POST localhost:3000/webhook -d '{"type": "message", ...}'
+"""
+import argparse
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import local_stub
+
+logger = logging.getLogger(__name__)
+
+
+def build_proxy_event(method, raw_path, headers, body_bytes, stage='local'):
+    """HTTPリクエストを API Gateway（REST API）のプロキシイベントに変換"""
+    parts = urlsplit(raw_path)
+    query = parse_qs(parts.query, keep_blank_values=True)
+
+    try:
+        body = body_bytes.decode('utf-8') if body_bytes else None
+        is_base64 = False
+    except UnicodeDecodeError:
+        body = base64.b64encode(body_bytes).decode('ascii')
+        is_base64 = True
+
+    multi_headers = {}
+    for key, value in headers:
+        multi_headers.setdefault(key, []).append(value)
+
+    return {
+        'resource': parts.path,
+        'path': parts.path,
+        'httpMethod': method,
+        'headers': {key: values[-1] for key, values in multi_headers.items()},
+        'multiValueHeaders': multi_headers,
+        'queryStringParameters': {key: values[-1] for key, values in query.items()} or None,
+        'multiValueQueryStringParameters': query or None,
+        'pathParameters': None,
+        'stageVariables': None,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'stage': stage,
+            'httpMethod': method,
+            'path': f"/{stage}{parts.path}",
+            'requestTimeEpoch': int(time.time() * 1000)
+        },
+        'body': body,
+        'isBase64Encoded': is_base64
+    }
+
+
+class _LocalContext:
+    """Lambda の context オブジェクトの最小限の代替"""
+
+    function_name = 'lineworks-bot-local'
+    memory_limit_in_mb = 128
+
+    def __init__(self, request_id, timeout_seconds=30):
+        self.aws_request_id = request_id
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def _invoke_in_worker(event):
+    """ワーカープロセス内で lambda_handler を呼び出す（プロセスごとに一度だけ import される）"""
+    import lambda_function
+    context = _LocalContext(event['requestContext']['requestId'])
+    return os.getpid(), lambda_function.lambda_handler(event, context)
+
+
+class ThreadInvoker:
+    """同一プロセス内のスレッドで呼び出す（同時実行数をセマフォで制限）"""
+
+    def __init__(self, concurrency):
+        import lambda_function
+        self._handler = lambda_function.lambda_handler
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def invoke(self, event):
+        with self._slots:
+            context = _LocalContext(event['requestContext']['requestId'])
+            return os.getpid(), self._handler(event, context)
+
+    def close(self):
+        pass
+
+
+class ProcessInvoker:
+    """ワーカープロセスのプールで呼び出す（グローバル変数はワーカーごとに分離）"""
+
+    def __init__(self, concurrency):
+        # fork だと親プロセスの状態を引き継ぐため、コンテナの起動と同様に spawn で新規に起動する
+        self._pool = multiprocessing.get_context('spawn').Pool(processes=concurrency)
+
+    def invoke(self, event):
+        return self._pool.apply(_invoke_in_worker, (event,))
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+class _LambdaProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body_bytes = self.rfile.read(length) if length else b''
+        event = build_proxy_event(self.command, self.path, self.headers.items(), body_bytes)
+
+        started = time.perf_counter()
+        try:
+            worker_pid, result = self.server.invoker.invoke(event)
+        except Exception as e:
+            logger.exception("Handler invocation failed")
+            worker_pid, result = None, {
+                'statusCode': 502,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({"error": f"Handler invocation failed: {str(e)}"})
+            }
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        body = result.get('body') or ''
+        if result.get('isBase64Encoded'):
+            payload = base64.b64decode(body)
+        else:
+            payload = body.encode('utf-8') if isinstance(body, str) else body
+
+        self.send_response(result.get('statusCode', 200))
+        for key, value in (result.get('headers') or {}).items():
+            self.send_header(key, str(value))
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+        print(f"{self.command} {self.path} -> {result.get('statusCode')} "
+              f"({elapsed_ms:.1f} ms, worker {worker_pid})", flush=True)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+    do_HEAD = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lambda ハンドラーをローカルで実行するHTTPサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread',
+                        help='thread: スレッドで並行実行 / process: ワーカープロセスで並行実行（グローバル変数を分離）')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時に実行するハンドラーの数')
+    parser.add_argument('--stub', action='store_true', help='LINE WORKS API スタブを起動して接続先にする')
+    parser.add_argument('--stub-latency-ms', type=float, default=0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    stub = None
+    if args.stub:
+        # ワーカーが起動する前に環境変数を設定しておく（spawn したワーカーにも引き継がれる）
+        stub = local_stub.start_stub_server(latency_ms=args.stub_latency_ms, error_rate=args.stub_error_rate)
+        local_stub.configure_environment(stub.base_url)
+        print(f"LINE WORKS API stub: {stub.base_url}")
+
+    invoker = ProcessInvoker(args.concurrency) if args.mode == 'process' else ThreadInvoker(args.concurrency)
+
+    server = ThreadingHTTPServer((args.host, args.port), _LambdaProxyHandler)
+    server.daemon_threads = True
+    server.invoker = invoker
+    print(f"Local Lambda server listening on http://{args.host}:{args.port} "
+          f"(mode={args.mode}, concurrency={args.concurrency})")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        invoker.close()
+        if stub is not None:
+            stub.shutdown()
+            print(f"Stub request counts: {stub.counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""ローカル検証用の LINE WORKS API スタブ
+
+トークン発行・メッセージ送信・ユーザー一覧の各APIを模したHTTPサーバー。
+LINEWORKS_AUTH_BASE_URL / LINEWORKS_API_BASE_URL をこのサーバーに向けると、
+実際の LINE WORKS にメッセージを送らずにハンドラーを動かせる。
+
+使い方:
+    python local_stub.py --port 8081 --latency-ms 20
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_MESSAGES_PATH = re.compile(r'^/v1\.0/bots/[^/]+/(users|channels)/[^/]+/messages$')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # リクエストごとのアクセスログは出力しない
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _respond(self, status, body=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if payload and self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _simulate(self, kind):
+        """遅延とエラーを注入し、エラーを返した場合は True"""
+        server = self.server
+        server.count(kind)
+        if server.latency_ms:
+            time.sleep(server.latency_ms / 1000.0)
+        if server.error_rate and random.random() < server.error_rate:
+            server.count('errors')
+            self._respond(500, {"code": "INTERNAL_SERVER_ERROR", "description": "stub injected error"})
+            return True
+        return False
+
+    def do_POST(self):
+        self._read_body()
+        path = self.path.split('?', 1)[0]
+        if path == '/oauth2/v2.0/token':
+            if self._simulate('token'):
+                return
+            self._respond(200, {
+                "access_token": f"stub-token-{int(time.time())}",
+                "token_type": "Bearer",
+                "expires_in": 86400,
+                "scope": "bot"
+            })
+        elif _MESSAGES_PATH.match(path):
+            if self._simulate('messages'):
+                return
+            self._respond(201)
+        else:
+            self._respond(404, {"code": "NOT_FOUND"})
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/v1.0/users':
+            if self._simulate('users'):
+                return
+            self._respond(200, {"users": [], "responseMetaData": {"nextCursor": None}})
+        else:
+            self._respond(404, {"code": "NOT_FOUND"})
+
+    def do_HEAD(self):
+        self.server.count('probes')
+        self._respond(200)
+
+
+class StubServer(ThreadingHTTPServer):
+    """リクエスト数を集計するスタブサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0, error_rate=0.0):
+        super().__init__(address, _StubHandler)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self._counts_lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind):
+        with self._counts_lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency_ms=0, error_rate=0.0):
+    """スタブサーバーをバックグラウンドスレッドで起動して返す"""
+    server = StubServer((host, port), latency_ms=latency_ms, error_rate=error_rate)
+    thread = threading.Thread(target=server.serve_forever, name='lineworks-stub', daemon=True)
+    thread.start()
+    return server
+
+
+def configure_environment(base_url, environ=None):
+    """ハンドラーがスタブに接続するよう環境変数を設定
+
+    認証情報が未設定の場合はダミー値と使い捨てのRSA鍵を設定する
+    （JWT署名の処理はスタブ相手でも本番と同じように実行される）。
+    http_client の import 前に呼び出すこと。
+    """
+    environ = environ if environ is not None else os.environ
+    environ['LINEWORKS_AUTH_BASE_URL'] = base_url
+    environ['LINEWORKS_API_BASE_URL'] = base_url
+    environ.setdefault('LINEWORKS_CLIENT_ID', 'stub-client-id')
+    environ.setdefault('LINEWORKS_CLIENT_SECRET', 'stub-client-secret')
+    environ.setdefault('LINEWORKS_SERVICE_ACCOUNT_ID', 'stub.serviceaccount@example')
+    environ.setdefault('LINEWORKS_BOT_ID', '10207111')
+    if not environ.get('LINEWORKS_PRIVATE_KEY'):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        environ['LINEWORKS_PRIVATE_KEY'] = base64.b64encode(pem).decode('ascii')
+    return environ
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LINE WORKS API のローカルスタブ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0, help='各APIレスポンスに加える遅延（ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500エラーを返す割合（0〜1）')
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), latency_ms=args.latency_ms, error_rate=args.error_rate)
+    print(f"LINE WORKS API stub listening on {server.base_url}")
+    print(f"  export LINEWORKS_AUTH_BASE_URL={server.base_url}")
+    print(f"  export LINEWORKS_API_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Request counts: {server.counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""ローカライズ済みメッセージテンプレートのレジストリ
+
+テンプレートはロケールごとの JSON ファイル（locales/ja.json など、
+テンプレートID -> "受信しました: {text}" 形式の文字列）で管理する。
+各テンプレートはプロセス内で一度だけ解析して描画関数にコンパイルし、
+フォールバック後のロケール -> テンプレートID の2段の dict にキャッシュする。書式指定のないテンプレートは
+% 書式に変換しておき、描画時は operator.itemgetter で取り出したパラメーターを % で埋め込むだけにする
+（str.format(**params) のような書式文字列の解析やキーワード引数の dict の生成を行わない）。
+
+ロケールは ja-JP -> ja -> 既定ロケール（TEMPLATE_DEFAULT_LOCALE）の順にフォールバックする。
+TEMPLATE_RELOAD_SECONDS を指定すると、その間隔でテンプレートディレクトリの
+更新を確認し、変更があれば読み込み直す（ローカル開発用）。
+"""
+import json
+import logging
+import operator
+import os
+import string
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 同梱のテンプレートディレクトリ
+DEFAULT_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+_formatter = string.Formatter()
+
+# クライアントが送る locale 文字列のうち、そのままキャッシュのキーに使う種類数の上限
+MAX_LOCALE_ALIASES = 64
+
+
+class TemplateError(Exception):
+    """テンプレートが見つからない・書式が不正・パラメーターが足りない場合の例外"""
+
+
+def compile_template(source, template_id=None):
+    """テンプレート文字列を解析し、params（dict）を受け取る描画関数を返す"""
+    parts = []
+    fields = []
+    try:
+        parsed = list(_formatter.parse(source))
+    except ValueError as e:
+        raise TemplateError(f"Invalid template {template_id}: {str(e)}")
+
+    for literal, field_name, format_spec, conversion in parsed:
+        if literal:
+            parts.append(literal)
+        if field_name is None:
+            continue
+        if not field_name.isidentifier() or conversion:
+            raise TemplateError(f"Invalid placeholder in template {template_id}: {{{field_name}}}")
+        if '{' in format_spec:
+            # {n:{width}} のような入れ子の書式指定はパラメーターから組み立てないため受け付けない
+            raise TemplateError(f"Nested format spec is not supported in template {template_id}: {{{field_name}:{format_spec}}}")
+        fields.append((len(parts), field_name, format_spec))
+        parts.append(None)
+
+    if not fields:
+        constant = ''.join(parts)
+        return lambda params=None: constant
+
+    def missing(e):
+        return TemplateError(f"Missing parameter for template {template_id}: {e.args[0]}")
+
+    if not any(format_spec for _, _, format_spec in fields):
+        # 固定部分の % をエスケープし、プレースホルダーを %s にした書式（%s は str() と同じ変換）
+        template = ''.join('%s' if part is None else part.replace('%', '%%') for part in parts)
+        names = [name for _, name, _ in fields]
+        if len(names) == 1:
+            [name] = names
+
+            def render(params):
+                try:
+                    return template % (params[name],)
+                except KeyError as e:
+                    raise missing(e)
+        else:
+            getter = operator.itemgetter(*names)
+
+            def render(params):
+                try:
+                    return template % getter(params)
+                except KeyError as e:
+                    raise missing(e)
+        return render
+
+    def render(params):
+        out = parts.copy()
+        try:
+            for index, name, format_spec in fields:
+                value = params[name]
+                if format_spec:
+                    out[index] = format(value, format_spec)
+                else:
+                    out[index] = value if type(value) is str else str(value)
+        except KeyError as e:
+            raise missing(e)
+        except (ValueError, TypeError) as e:
+            # {n:d} に文字列を渡した場合など、値が書式指定に合わない
+            raise TemplateError(f"Invalid parameter for template {template_id}: {name}: {str(e)}")
+        return ''.join(out)
+
+    return render
+
+
+class TemplateRegistry:
+    """テンプレートの読み込み・コンパイル済み描画関数のキャッシュ"""
+
+    def __init__(self, template_dir=None, default_locale=None, reload_seconds=None):
+        self.template_dir = template_dir or os.environ.get('TEMPLATE_DIR', DEFAULT_TEMPLATE_DIR)
+        self.default_locale = default_locale or os.environ.get('TEMPLATE_DEFAULT_LOCALE', 'ja')
+        if reload_seconds is None:
+            reload_seconds = float(os.environ.get('TEMPLATE_RELOAD_SECONDS', '0'))
+        self.reload_seconds = reload_seconds
+
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._compiled = {}
+        self._locale_aliases = set()
+        self._signature = None
+        self._next_check = 0.0
+        self.reloads = 0
+        self.load()
+
+    def _scan(self):
+        """テンプレートディレクトリの (ファイル名, 更新時刻, サイズ) の一覧"""
+        try:
+            entries = os.scandir(self.template_dir)
+        except FileNotFoundError:
+            return ()
+        with entries:
+            return tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in entries if entry.name.endswith('.json')
+            ))
+
+    def load(self):
+        """ディレクトリ内の全ロケールを読み込み、コンパイル済みキャッシュを破棄する"""
+        signature = self._scan()
+        sources = {}
+        for name, _, _ in signature:
+            locale = name[:-len('.json')]
+            path = os.path.join(self.template_dir, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    templates = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"Failed to load templates from {path}: {str(e)}")
+                continue
+            if not isinstance(templates, dict):
+                logger.error(f"Template file {path} must contain an object")
+                continue
+            sources[locale] = templates
+
+        with self._lock:
+            self._sources = sources
+            self._compiled = {}
+            self._locale_aliases = set()
+            self._signature = signature
+            self._next_check = time.monotonic() + self.reload_seconds
+        logger.info(f"Loaded templates for locales {sorted(sources)} from {self.template_dir}")
+
+    def reload_if_changed(self):
+        """ファイルの更新を確認し、変更があれば読み込み直す（変更があれば True）"""
+        if self._scan() == self._signature:
+            return False
+        self.load()
+        self.reloads += 1
+        return True
+
+    def _locale_chain(self, locale):
+        chain = []
+        if locale:
+            chain.append(locale)
+            base = locale.replace('_', '-').split('-')[0]
+            if base != locale:
+                chain.append(base)
+        if self.default_locale not in chain:
+            chain.append(self.default_locale)
+        return chain
+
+    def get(self, template_id, locale=None):
+        """コンパイル済みの描画関数を取得"""
+        if self.reload_seconds > 0 and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_seconds
+            self.reload_if_changed()
+
+        # キャッシュのヒット時はタプルのキーを作らず、dict を2回引くだけにする
+        by_locale = self._compiled.get(locale)
+        if by_locale is not None:
+            compiled = by_locale.get(template_id)
+            if compiled is not None:
+                return compiled
+
+        # 描画関数はフォールバック後のロケールをキーにキャッシュし、クライアントが送った
+        # locale 文字列は MAX_LOCALE_ALIASES 種類まで別名として登録する（任意の文字列でキャッシュが膨らまないように）
+        sources = self._sources
+        for candidate in self._locale_chain(locale):
+            compiled = self._compiled.get(candidate, {}).get(template_id)
+            if compiled is not None:
+                break
+            source = sources.get(candidate, {}).get(template_id)
+            if source is not None:
+                compiled = compile_template(source, template_id)
+                break
+        else:
+            raise TemplateError(f"Template not found: {template_id} (locale: {locale})")
+
+        with self._lock:
+            # 読み込み直しの最中に古いテンプレートをキャッシュしない
+            if self._sources is sources:
+                self._compiled.setdefault(candidate, {})[template_id] = compiled
+                if locale in self._locale_aliases or len(self._locale_aliases) < MAX_LOCALE_ALIASES:
+                    self._locale_aliases.add(locale)
+                    self._compiled.setdefault(locale, {})[template_id] = compiled
+        return compiled
+
+    def render(self, template_id, params=None, locale=None):
+        """テンプレートを描画した文字列を返す"""
+        return self.get(template_id, locale)(params or {})
+
+    def stats(self):
+        """読み込み済みのロケール・テンプレート数・キャッシュ件数を返す"""
+        return {
+            "template_dir": self.template_dir,
+            "locales": {locale: len(templates) for locale, templates in self._sources.items()},
+            "compiled": sum(len(by_locale) for by_locale in self._compiled.values()),
+            "reloads": self.reloads
+        }
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """プロセス内で共有するレジストリを取得（コンテナ起動時に一度だけ読み込む）"""
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = TemplateRegistry()
+    return _default_registry
+
+
+def render(template_id, params=None, locale=None):
+    """共有レジストリでテンプレートを描画する"""
+    return get_registry().render(template_id, params, locale)
@@ -0,0 +1,98 @@
+"""送信メッセージの事前シリアライズと重複抑止
+
+同じ内容を多数のユーザーに送る場合、メッセージ本文は PreparedMessage で
+一度だけ JSON バイト列にしておき、宛先ごとには URL だけを組み立てる。
+MessageDeduplicator は同じユーザーへ同じ内容を一定時間内に再送しないようにする。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class PreparedMessage:
+    """送信用にシリアライズ済みのメッセージ本文"""
+
+    __slots__ = ('content', 'body', 'digest')
+
+    def __init__(self, content):
+        self.content = content
+        self.body = json.dumps({"content": content}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.digest = hashlib.sha1(self.body).hexdigest()
+
+
+def build_auth_headers(access_token):
+    """送信APIの共通ヘッダー（同じトークンの間は使い回す）"""
+    return {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json; charset=UTF-8'
+    }
+
+
+class MessageDeduplicator:
+    """同一ユーザーへの同一メッセージを window_seconds の間は抑止する"""
+
+    def __init__(self, window_seconds=None, max_entries=100000):
+        if window_seconds is None:
+            window_seconds = float(os.environ.get('OUTBOUND_DEDUP_WINDOW_SECONDS', '30'))
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (bot_id, user_id, digest) -> 送信時刻（挿入順 = 時刻順）
+        self._seen = OrderedDict()
+        self.suppressed = 0
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._seen:
+            key, sent_at = next(iter(self._seen.items()))
+            if sent_at > cutoff and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+
+    def should_send(self, bot_id, user_id, digest, now=None):
+        """送信してよければ記録して True、抑止すべきなら False を返す"""
+        if self.window_seconds <= 0:
+            return True
+        now = now if now is not None else time.monotonic()
+        key = (bot_id, user_id, digest)
+        with self._lock:
+            self._prune(now)
+            if key in self._seen:
+                self.suppressed += 1
+                return False
+            self._seen[key] = now
+            return True
+
+    def forget(self, bot_id, user_id, digest):
+        """送信に失敗した場合に記録を取り消し、再送できるようにする"""
+        with self._lock:
+            self._seen.pop((bot_id, user_id, digest), None)
+
+
+class RateLimiter:
+    """トークンバケット方式の送信レート制限"""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = float(burst if burst is not None else max(1.0, rate_per_second))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """送信枠が空くまで待つ"""
+        if self.rate_per_second <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate_per_second
+            time.sleep(wait)
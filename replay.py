@@ -0,0 +1,294 @@
+"""キャプチャしたWebhookトラフィックのリプレイ / ベンチマークツール
+
+JSONL形式のキャプチャを1行ずつ読み込み（ファイル全体はメモリに載せない）、
+lambda_handler または Azure Functions の webhook ルートに投入して
+スループットとレイテンシを計測する。
+
+JSONLの各行は次のいずれかの形式を受け付ける:
+  - API Gateway のプロキシイベント（httpMethod / path / body を持つ）
+  - webhook_logs のエントリ（request_body / headers / timestamp を持つ旧形式、
+    または event.raw_body を持つ形式。raw_body はデバッグログ有効時のみ記録される）
+  - LINE WORKS の Webhook ボディそのもの（type を持つ）
+
+再生モード:
+  original     キャプチャの時刻間隔どおりに投入
+  accelerated  時刻間隔を --speed 倍に短縮して投入
+  max          待たずに最大スループットで投入
+
+使い方:
+    python replay.py captures.jsonl --mode max --concurrency 8 --stub --output report.json
+    python replay.py captures.jsonl --mode max --stub --baseline report.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import local_stub
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        # ミリ秒のUnix時間にも対応
+        return value / 1000.0 if value > 1e11 else float(value)
+    text = str(value)
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+def to_replay_item(record):
+    """キャプチャ1件を (時刻, パス, メソッド, ヘッダー, ボディ文字列) に変換（対象外は None）"""
+    if not isinstance(record, dict):
+        return None
+
+    if 'httpMethod' in record:
+        body = record.get('body')
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body, ensure_ascii=False)
+        timestamp = _parse_timestamp((record.get('requestContext') or {}).get('requestTimeEpoch'))
+        return (timestamp, record.get('path', '/webhook'), record['httpMethod'],
+                record.get('headers') or {}, body)
+
+    if 'request_body' in record:
+        body = record['request_body']
+        return (_parse_timestamp(record.get('timestamp')), '/webhook', 'POST',
+                record.get('headers') or {},
+                json.dumps(body, ensure_ascii=False) if body is not None else None)
+
+    if isinstance(record.get('event'), dict):
+        raw_body = record['event'].get('raw_body')
+        if raw_body is None:
+            return None
+        return (_parse_timestamp(record.get('timestamp')), '/webhook', 'POST',
+                {'Content-Type': 'application/json'}, raw_body)
+
+    if 'type' in record:
+        return (_parse_timestamp(record.get('issuedTime')), '/webhook', 'POST',
+                {'Content-Type': 'application/json'},
+                json.dumps(record, ensure_ascii=False))
+
+    return None
+
+
+def iter_captures(path, stats):
+    """JSONLファイルをストリーミングで読み込みリプレイ項目を返す"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = to_replay_item(json.loads(line))
+            except json.JSONDecodeError:
+                item = None
+            if item is None:
+                stats['skipped'] += 1
+                continue
+            yield item
+
+
+def make_lambda_invoker():
+    import lambda_function
+
+    def invoke(path, method, headers, body):
+        event = {
+            'path': path,
+            'httpMethod': method,
+            'headers': headers,
+            'queryStringParameters': None,
+            'body': body
+        }
+        return lambda_function.lambda_handler(event, None)['statusCode']
+
+    return invoke
+
+
+def make_azure_invoker():
+    import azure.functions as func
+    import function_app
+
+    # デコレーター適用済みの関数から元のユーザー関数を取り出す
+    routes = {
+        '/webhook': function_app.webhook_receiver.build().get_user_function(),
+        '/send_message': function_app.send_message.build().get_user_function(),
+        '/health': function_app.health_check.build().get_user_function()
+    }
+
+    def invoke(path, method, headers, body):
+        handler = routes.get(path)
+        if handler is None:
+            return 404
+        req = func.HttpRequest(
+            method=method,
+            url=f"http://localhost/api{path}",
+            headers=headers,
+            body=(body or '').encode('utf-8')
+        )
+        return handler(req).status_code
+
+    return invoke
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_replay(path, invoke, mode='max', speed=10.0, concurrency=1, limit=None):
+    """キャプチャを再生し、計測結果を返す"""
+    stats = {'skipped': 0}
+    latencies = []
+    status_counts = {}
+    lock = threading.Lock()
+    # 投入中のリクエスト数を制限し、キャプチャを先読みしすぎないようにする
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def execute(item):
+        _, item_path, method, headers, body = item
+        started = time.perf_counter()
+        try:
+            status = invoke(item_path, method, headers, body)
+        except Exception as e:
+            status = f"exception:{type(e).__name__}"
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        slots.release()
+
+    first_capture_time = None
+    replay_started = time.perf_counter()
+    sent = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for item in iter_captures(path, stats):
+            if limit is not None and sent >= limit:
+                break
+
+            timestamp = item[0]
+            if mode != 'max' and timestamp is not None:
+                if first_capture_time is None:
+                    first_capture_time = timestamp
+                offset = timestamp - first_capture_time
+                if mode == 'accelerated':
+                    offset /= speed
+                delay = offset - (time.perf_counter() - replay_started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            slots.acquire()
+            executor.submit(execute, item)
+            sent += 1
+
+    duration = time.perf_counter() - replay_started
+    latencies.sort()
+    errors = sum(count for status, count in status_counts.items() if not status.startswith('2'))
+
+    return {
+        'mode': mode,
+        'speed': speed if mode == 'accelerated' else None,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'skipped': stats['skipped'],
+        'errors': errors,
+        'status_counts': status_counts,
+        'duration_seconds': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration > 0 else 0.0,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 3) if latencies else 0.0,
+            'p50': round(_percentile(latencies, 50), 3),
+            'p90': round(_percentile(latencies, 90), 3),
+            'p99': round(_percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0
+        }
+    }
+
+
+def compare_reports(baseline, current, threshold):
+    """ベースラインと比較し、しきい値を超えて悪化した指標の一覧を返す"""
+    regressions = []
+    for key in ('p50', 'p90', 'p99'):
+        before = baseline['latency_ms'].get(key) or 0.0
+        after = current['latency_ms'].get(key) or 0.0
+        if before > 0 and (after - before) / before > threshold:
+            regressions.append(f"latency {key}: {before:.3f}ms -> {after:.3f}ms (+{(after - before) / before:.1%})")
+
+    before = baseline.get('throughput_rps') or 0.0
+    after = current.get('throughput_rps') or 0.0
+    if before > 0 and (before - after) / before > threshold:
+        regressions.append(f"throughput: {before:.2f} -> {after:.2f} req/s (-{(before - after) / before:.1%})")
+
+    if current['errors'] > baseline.get('errors', 0):
+        regressions.append(f"errors: {baseline.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='キャプチャしたWebhookトラフィックをリプレイして計測')
+    parser.add_argument('captures', help='JSONL形式のキャプチャファイル')
+    parser.add_argument('--target', choices=['lambda', 'azure'], default='lambda')
+    parser.add_argument('--mode', choices=['original', 'accelerated', 'max'], default='max')
+    parser.add_argument('--speed', type=float, default=10.0, help='accelerated モードの倍速')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--limit', type=int, default=None, help='再生する最大件数')
+    parser.add_argument('--stub', action='store_true', help='ローカルのAPIスタブを起動して接続先にする')
+    parser.add_argument('--stub-latency-ms', type=float, default=0)
+    parser.add_argument('--output', help='計測結果を書き出すJSONファイル')
+    parser.add_argument('--baseline', help='比較対象の計測結果JSONファイル')
+    parser.add_argument('--threshold', type=float, default=0.1, help='悪化とみなす割合（既定 10%%）')
+    args = parser.parse_args(argv)
+
+    stub = None
+    if args.stub:
+        stub = local_stub.start_stub_server(latency_ms=args.stub_latency_ms)
+        local_stub.configure_environment(stub.base_url)
+    elif not os.environ.get('LINEWORKS_API_BASE_URL'):
+        print("WARNING: --stub is not set; replies will be sent to the real LINE WORKS API", file=sys.stderr)
+
+    invoke = make_azure_invoker() if args.target == 'azure' else make_lambda_invoker()
+
+    # ハンドラーのログ出力が計測を歪めないよう抑制
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = run_replay(args.captures, invoke, mode=args.mode, speed=args.speed,
+                        concurrency=args.concurrency, limit=args.limit)
+    report['target'] = args.target
+    if stub is not None:
+        report['stub_requests'] = dict(stub.counts)
+        stub.shutdown()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions:
+            print("Regressions detected:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  - {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
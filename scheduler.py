@@ -0,0 +1,563 @@
+"""予約・遅延メッセージ送信のスケジューラ
+
+送信予定のメッセージを送信時刻（due_at）付きで永続ストアに登録し、
+EventBridge / Timer Trigger から定期的に呼ばれる tick で期限到来分を
+バッチ送信する。
+
+ストアは SCHEDULER_BACKEND で選択する。
+
+  sqlite    ローカル検証用（既定、SCHEDULER_DB_PATH）。Lambda の /tmp はコンテナごとで
+            永続しないため、登録したコンテナと tick を実行するコンテナが違うと送信されない
+  dynamodb  DynamoDB（SCHEDULER_TABLE、boto3 を使用）。コンテナ間で共有する実運用向け
+
+どちらも (status, due_at) のインデックス（DynamoDB ではグローバルセカンダリインデックス）を
+時刻順のキューとして使うため、tick はインデックスの範囲走査だけで期限到来分を取り出せ、
+数万件の保留メッセージがあってもテーブル全体を走査しない。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# SQLiteファイルの既定パス（Lambdaでは /tmp のみ書き込み可能）
+DEFAULT_DB_PATH = '/tmp/scheduled_messages.db'
+
+# DynamoDB のインデックス名（パーティションキー status、ソートキー due_at）
+DEFAULT_STATUS_INDEX = 'status-due_at'
+
+# 送信済み・失敗した項目を DynamoDB の TTL で削除するまでの秒数
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 3600
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def parse_send_at(value, now=None):
+    """送信時刻をUnix時間に変換（Unix時間の数値またはISO 8601文字列を受け付ける）"""
+    if value is None:
+        return now if now is not None else time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    # 'Z' サフィックスは Python 3.11 未満の fromisoformat で扱えないため置換
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid send_at format: {value}")
+
+
+class ScheduledMessageStore:
+    """予約メッセージの永続ストア（SQLite、ローカル検証用）"""
+
+    # Lambda ではコンテナ間で共有されない
+    durable = False
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get('SCHEDULER_DB_PATH', DEFAULT_DB_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scheduled_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bot_id TEXT,
+                    user_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    due_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # 時刻順キューとして使う複合インデックス
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_scheduled_messages_status_due
+                ON scheduled_messages (status, due_at)
+            """)
+
+    def enqueue(self, user_id, text, send_at, bot_id=None, content=None):
+        """メッセージを送信予定に登録し、IDを返す"""
+        if not user_id:
+            raise ValueError("user_id is required")
+        if content is None:
+            content = {"type": "text", "text": text}
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO scheduled_messages
+                    (bot_id, user_id, content, due_at, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (bot_id, user_id, json.dumps(content, ensure_ascii=False),
+                 float(send_at), STATUS_PENDING, now, now)
+            )
+            return cursor.lastrowid
+
+    def cancel(self, message_id):
+        """未送信のメッセージを取り消す"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM scheduled_messages WHERE id = ? AND status = ?",
+                (message_id, STATUS_PENDING)
+            )
+            return cursor.rowcount > 0
+
+    def claim_due(self, now, limit, lease_seconds=300):
+        """期限到来分を時刻順に取り出し、送信中としてリースする
+
+        送信中の行は due_at をリース期限に書き換えておくため、
+        処理中にコンテナが落ちてもリース切れ後の tick で再取得される。
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = []
+                for status in (STATUS_PENDING, STATUS_SENDING):
+                    remaining = limit - len(rows)
+                    if remaining <= 0:
+                        break
+                    rows.extend(self._conn.execute(
+                        """
+                        SELECT id, bot_id, user_id, content, due_at, attempts
+                        FROM scheduled_messages
+                        WHERE status = ? AND due_at <= ?
+                        ORDER BY due_at
+                        LIMIT ?
+                        """,
+                        (status, now, remaining)
+                    ).fetchall())
+                if rows:
+                    self._conn.executemany(
+                        """
+                        UPDATE scheduled_messages
+                        SET status = ?, due_at = ?, attempts = attempts + 1, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        [(STATUS_SENDING, now + lease_seconds, now, row['id']) for row in rows]
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        return [{
+            "id": row['id'],
+            "bot_id": row['bot_id'],
+            "user_id": row['user_id'],
+            "content": json.loads(row['content']),
+            "attempts": row['attempts'] + 1
+        } for row in rows]
+
+    def mark_sent(self, message_ids):
+        """送信済みにする"""
+        if not message_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE scheduled_messages SET status = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                [(STATUS_SENT, now, message_id) for message_id in message_ids]
+            )
+
+    def mark_failed(self, message_id, error, retry_at=None):
+        """送信失敗を記録（retry_at を指定した場合は再送予定に戻す）"""
+        now = time.time()
+        with self._lock:
+            if retry_at is not None:
+                self._conn.execute(
+                    "UPDATE scheduled_messages SET status = ?, due_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_PENDING, retry_at, str(error), now, message_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE scheduled_messages SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_FAILED, str(error), now, message_id)
+                )
+
+    def release(self, message_ids):
+        """リース中のメッセージを送信せずに未送信へ戻す（試行回数も元に戻す）"""
+        if not message_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                UPDATE scheduled_messages
+                SET status = ?, due_at = ?, attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE id = ? AND status = ?
+                """,
+                [(STATUS_PENDING, now, now, message_id, STATUS_SENDING) for message_id in message_ids]
+            )
+
+    def purge_sent(self, older_than):
+        """送信済みの古い行を削除する"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM scheduled_messages WHERE status = ? AND updated_at < ?",
+                (STATUS_SENT, older_than)
+            )
+            return cursor.rowcount
+
+    def stats(self):
+        """ステータス別の件数と次回送信予定時刻を返す"""
+        with self._lock:
+            counts = {
+                row['status']: row['count']
+                for row in self._conn.execute(
+                    "SELECT status, COUNT(*) AS count FROM scheduled_messages GROUP BY status"
+                )
+            }
+            next_row = self._conn.execute(
+                "SELECT MIN(due_at) AS next_due FROM scheduled_messages WHERE status = ?",
+                (STATUS_PENDING,)
+            ).fetchone()
+        return {
+            "counts": counts,
+            "next_due_at": next_row['next_due'] if next_row else None
+        }
+
+
+class DynamoDBScheduledMessageStore:
+    """予約メッセージの永続ストア（DynamoDB）
+
+    テーブルはパーティションキー id（文字列）で、status をパーティションキー・due_at を
+    ソートキーとするグローバルセカンダリインデックスを持つこと。TTL 属性には expires_at を
+    設定しておくと、送信済み・失敗した項目は保持期間の経過後に削除される。
+    インデックスの読み込みは結果整合性なので、取り出し（リース）は条件付き更新で行い、
+    複数のコンテナが同じメッセージを取り出さないようにする。
+    """
+
+    durable = True
+
+    def __init__(self, table_name=None, index_name=None, client=None, retention_seconds=None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+        self.table_name = table_name or os.environ['SCHEDULER_TABLE']
+        self.index_name = index_name or os.environ.get('SCHEDULER_STATUS_INDEX', DEFAULT_STATUS_INDEX)
+        if retention_seconds is None:
+            retention_seconds = float(os.environ.get('SCHEDULER_RETENTION_SECONDS', DEFAULT_RETENTION_SECONDS))
+        self.retention_seconds = retention_seconds
+        self._client = client
+
+    def enqueue(self, user_id, text, send_at, bot_id=None, content=None):
+        """送信予約を登録し、メッセージIDを返す"""
+        if content is None:
+            content = {"type": "text", "text": text}
+        now = time.time()
+        message_id = uuid.uuid4().hex
+        item = {
+            'id': {'S': message_id},
+            'user_id': {'S': user_id},
+            'content': {'S': json.dumps(content, ensure_ascii=False)},
+            'due_at': {'N': repr(float(send_at))},
+            'status': {'S': STATUS_PENDING},
+            'attempts': {'N': '0'},
+            'created_at': {'N': repr(now)},
+            'updated_at': {'N': repr(now)}
+        }
+        if bot_id:
+            item['bot_id'] = {'S': bot_id}
+        self._client.put_item(TableName=self.table_name, Item=item)
+        return message_id
+
+    def cancel(self, message_id):
+        """未送信のメッセージを取り消す"""
+        try:
+            self._client.delete_item(
+                TableName=self.table_name,
+                Key={'id': {'S': str(message_id)}},
+                ConditionExpression='#status = :pending',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':pending': {'S': STATUS_PENDING}}
+            )
+            return True
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def _query_due(self, status, now, limit):
+        """インデックスから期限到来分の id を時刻順に返す"""
+        ids = []
+        kwargs = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': '#status = :status AND due_at <= :now',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':status': {'S': status}, ':now': {'N': repr(float(now))}},
+            'ProjectionExpression': 'id'
+        }
+        while len(ids) < limit:
+            response = self._client.query(Limit=limit - len(ids), **kwargs)
+            ids.extend(item['id']['S'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return ids
+
+    def claim_due(self, now, limit, lease_seconds=300):
+        """期限到来分を時刻順に取り出し、送信中としてリースする
+
+        リース中の項目は due_at をリース期限に書き換えておくため、
+        処理中にコンテナが落ちてもリース切れ後の tick で再取得される。
+        """
+        claimed = []
+        for status in (STATUS_PENDING, STATUS_SENDING):
+            remaining = limit - len(claimed)
+            if remaining <= 0:
+                break
+            for message_id in self._query_due(status, now, remaining):
+                try:
+                    item = self._client.update_item(
+                        TableName=self.table_name,
+                        Key={'id': {'S': message_id}},
+                        UpdateExpression=('SET #status = :sending, due_at = :lease, '
+                                          'attempts = attempts + :one, updated_at = :now'),
+                        ConditionExpression='#status = :status AND due_at <= :now',
+                        ExpressionAttributeNames={'#status': 'status'},
+                        ExpressionAttributeValues={
+                            ':sending': {'S': STATUS_SENDING},
+                            ':status': {'S': status},
+                            ':lease': {'N': repr(float(now + lease_seconds))},
+                            ':one': {'N': '1'},
+                            ':now': {'N': repr(float(now))}
+                        },
+                        ReturnValues='ALL_NEW'
+                    )['Attributes']
+                except self._client.exceptions.ConditionalCheckFailedException:
+                    # 別のコンテナが先に取り出した（またはインデックスが古かった）
+                    continue
+                claimed.append({
+                    "id": item['id']['S'],
+                    "bot_id": item['bot_id']['S'] if 'bot_id' in item else None,
+                    "user_id": item['user_id']['S'],
+                    "content": json.loads(item['content']['S']),
+                    "attempts": int(item['attempts']['N'])
+                })
+        return claimed
+
+    def _finish(self, message_id, status, error=None):
+        now = time.time()
+        values = {
+            ':status': {'S': status},
+            ':now': {'N': repr(now)},
+            ':expires': {'N': str(int(now + self.retention_seconds))}
+        }
+        if error is None:
+            expression = 'SET #status = :status, updated_at = :now, expires_at = :expires REMOVE last_error'
+        else:
+            expression = 'SET #status = :status, updated_at = :now, expires_at = :expires, last_error = :error'
+            values[':error'] = {'S': str(error)}
+        self._client.update_item(
+            TableName=self.table_name,
+            Key={'id': {'S': str(message_id)}},
+            UpdateExpression=expression,
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues=values
+        )
+
+    def mark_sent(self, message_ids):
+        """送信済みにする（保持期間の経過後に TTL で削除される）"""
+        for message_id in message_ids:
+            self._finish(message_id, STATUS_SENT)
+
+    def mark_failed(self, message_id, error, retry_at=None):
+        """送信失敗を記録（retry_at を指定した場合は再送予定に戻す）"""
+        if retry_at is None:
+            self._finish(message_id, STATUS_FAILED, error)
+            return
+        self._client.update_item(
+            TableName=self.table_name,
+            Key={'id': {'S': str(message_id)}},
+            UpdateExpression='SET #status = :pending, due_at = :retry_at, last_error = :error, updated_at = :now',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':pending': {'S': STATUS_PENDING},
+                ':retry_at': {'N': repr(float(retry_at))},
+                ':error': {'S': str(error)},
+                ':now': {'N': repr(time.time())}
+            }
+        )
+
+    def release(self, message_ids):
+        """リース中のメッセージを送信せずに未送信へ戻す（試行回数も元に戻す）"""
+        now = time.time()
+        for message_id in message_ids:
+            try:
+                self._client.update_item(
+                    TableName=self.table_name,
+                    Key={'id': {'S': str(message_id)}},
+                    UpdateExpression='SET #status = :pending, due_at = :now, attempts = attempts - :one, updated_at = :now',
+                    ConditionExpression='#status = :sending',
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={
+                        ':pending': {'S': STATUS_PENDING},
+                        ':sending': {'S': STATUS_SENDING},
+                        ':one': {'N': '1'},
+                        ':now': {'N': repr(now)}
+                    }
+                )
+            except self._client.exceptions.ConditionalCheckFailedException:
+                pass
+
+    def purge_sent(self, older_than):
+        """送信済みの項目は TTL（expires_at）で削除されるため何もしない"""
+        return 0
+
+    def stats(self):
+        """ステータス別の件数と次回送信予定時刻を返す"""
+        counts = {}
+        for status in (STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED):
+            kwargs = {
+                'TableName': self.table_name,
+                'IndexName': self.index_name,
+                'KeyConditionExpression': '#status = :status',
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ExpressionAttributeValues': {':status': {'S': status}},
+                'Select': 'COUNT'
+            }
+            count = 0
+            while True:
+                response = self._client.query(**kwargs)
+                count += response.get('Count', 0)
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            if count:
+                counts[status] = count
+
+        response = self._client.query(
+            TableName=self.table_name,
+            IndexName=self.index_name,
+            KeyConditionExpression='#status = :status',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': {'S': STATUS_PENDING}},
+            ProjectionExpression='due_at',
+            Limit=1
+        )
+        items = response.get('Items', [])
+        return {
+            "counts": counts,
+            "next_due_at": float(items[0]['due_at']['N']) if items else None
+        }
+
+
+def run_tick(store, send_func, now=None, batch_size=100, max_batches=10,
+             max_attempts=3, retry_delay=60, on_failed=None, deadline=None, concurrency=8):
+    """期限到来分をバッチ単位で送信する（EventBridge / Timer Trigger から呼び出す）
+
+    send_func(item) は (成功したか, エラー内容) を返すこと。
+    on_failed(item, error) は再試行回数を使い切ったメッセージごとに呼び出す。
+    deadline（time.monotonic() の値）を過ぎたら新しいバッチを取り出さず、
+    未送信の分はリースを解放して次回の tick に回す。
+    送信に成功したメッセージはバッチの完了を待たずにその都度送信済みにするため、
+    tick が途中で打ち切られても送信済みの分が再送されることはない。
+    """
+    now = now if now is not None else time.time()
+    summary = {"claimed": 0, "sent": 0, "retried": 0, "failed": 0, "released": 0, "batches": 0}
+
+    def expired():
+        return deadline is not None and time.monotonic() >= deadline
+
+    def send(item):
+        if expired():
+            return item, None, None
+        try:
+            ok, error = send_func(item)
+        except Exception as e:
+            ok, error = False, str(e)
+        return item, ok, error
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for _ in range(max_batches):
+            if expired():
+                logger.warning("Scheduler tick stopped before deadline")
+                break
+            items = store.claim_due(now, batch_size)
+            if not items:
+                break
+            summary["batches"] += 1
+            summary["claimed"] += len(items)
+
+            released_ids = []
+            futures = [executor.submit(send, item) for item in items]
+            for future in as_completed(futures):
+                item, ok, error = future.result()
+                if ok is None:
+                    released_ids.append(item["id"])
+                elif ok:
+                    store.mark_sent([item["id"]])
+                    summary["sent"] += 1
+                elif item["attempts"] < max_attempts:
+                    store.mark_failed(item["id"], error, retry_at=now + retry_delay * item["attempts"])
+                    summary["retried"] += 1
+                else:
+                    store.mark_failed(item["id"], error)
+                    summary["failed"] += 1
+                    logger.error(f"Scheduled message {item['id']} failed permanently: {error}")
+                    if on_failed is not None:
+                        on_failed(item, error)
+
+            if released_ids:
+                store.release(released_ids)
+                summary["released"] += len(released_ids)
+                break
+
+            if len(items) < batch_size:
+                break
+
+    logger.info(f"Scheduler tick completed: {summary}")
+    return summary
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def create_store():
+    """SCHEDULER_BACKEND の設定に応じたストアを生成"""
+    backend = os.environ.get('SCHEDULER_BACKEND', 'sqlite').lower()
+    if backend == 'dynamodb':
+        return DynamoDBScheduledMessageStore()
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown SCHEDULER_BACKEND: {backend}")
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        logger.warning("SCHEDULER_BACKEND=sqlite is local to this Lambda container; use dynamodb in production")
+    return ScheduledMessageStore()
+
+
+def get_store():
+    """プロセス内で共有するストアを取得（コンテナ再利用時は接続を使い回す）"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = create_store()
+    return _default_store
@@ -0,0 +1,385 @@
+"""マルチターン対話用の会話状態ストア
+
+ユーザー / チャンネル単位のセッションを TTL 付きで保持する。
+プロセス内の LRU キャッシュを永続バックエンドの前段に置き、読み込みはリードスルー、
+書き込みはライトビハインドで行う。返信処理中はキャッシュだけを触り、
+バックエンドへの書き込みは flush() でまとめて行う。キャッシュの内容は
+SESSION_CACHE_FRESHNESS_SECONDS（セッションの有効期間とは別の短い時間）を過ぎたら
+バックエンドから読み直し、別のコンテナが書き込んだ更新を取り込む。
+
+バックエンドは SESSION_BACKEND で選択する。
+
+  sqlite    ローカル検証用（既定、SESSION_DB_PATH）。Lambda の /tmp はコンテナごとで共有されない
+  dynamodb  DynamoDB（SESSION_TABLE、boto3 を使用）。コンテナ間で共有する実運用向け
+
+書き込みはバージョン付きの楽観的排他制御で、同じユーザーへの Webhook が
+並行して届いても互いの更新を上書きしない。update() で更新した場合は、
+競合時に最新の値を読み直して更新処理を再適用する（flush() 時の競合も同様）。
+"""
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# SQLiteファイルの既定パス（Lambdaでは /tmp のみ書き込み可能）
+DEFAULT_DB_PATH = '/tmp/sessions.db'
+
+# update() と flush() で競合時に読み直して再適用する最大回数
+MAX_UPDATE_ATTEMPTS = 3
+
+
+class VersionConflictError(Exception):
+    """期待したバージョンと現在のバージョンが一致しない場合の例外"""
+
+    def __init__(self, key, expected_version, actual_version):
+        super().__init__(f"Session '{key}' version conflict: expected {expected_version}, actual {actual_version}")
+        self.key = key
+        self.expected_version = expected_version
+        self.actual_version = actual_version
+
+
+class SQLiteSessionBackend:
+    """セッションの永続バックエンド（SQLite）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get('SESSION_DB_PATH', DEFAULT_DB_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_expires
+                ON sessions (expires_at)
+            """)
+
+    def get(self, key, now):
+        """有効期限内のセッションを (data, version) で返す（なければ None）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, version FROM sessions WHERE session_key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, data, version, expected_version, expires_at):
+        """expected_version と一致する場合のみ書き込み、成否を返す"""
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            if expected_version == 0:
+                # 新規作成（期限切れの行は上書きしてよい）
+                cursor = self._conn.execute(
+                    """
+                    INSERT INTO sessions (session_key, data, version, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(session_key) DO UPDATE SET
+                        data = excluded.data,
+                        version = excluded.version,
+                        expires_at = excluded.expires_at
+                    WHERE sessions.expires_at <= ?
+                    """,
+                    (key, payload, version, expires_at, time.time())
+                )
+            else:
+                cursor = self._conn.execute(
+                    """
+                    UPDATE sessions SET data = ?, version = ?, expires_at = ?
+                    WHERE session_key = ? AND version = ?
+                    """,
+                    (payload, version, expires_at, key, expected_version)
+                )
+            return cursor.rowcount > 0
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_key = ?", (key,))
+
+    def purge_expired(self, now):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            return cursor.rowcount
+
+
+class DynamoDBSessionBackend:
+    """セッションの永続バックエンド（DynamoDB）
+
+    テーブルはパーティションキー session_key（文字列）。TTL 属性に expires_at を設定すること。
+    書き込みは version の条件付き書き込みで、コンテナ間の更新の競合を検出する。
+    """
+
+    def __init__(self, table_name=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+        self.table_name = table_name or os.environ['SESSION_TABLE']
+        self._client = client
+
+    def get(self, key, now):
+        """有効期限内のセッションを (data, version) で返す（なければ None）"""
+        item = self._client.get_item(
+            TableName=self.table_name,
+            Key={'session_key': {'S': key}},
+            ConsistentRead=True
+        ).get('Item')
+        # TTL による削除は遅れるため、期限切れの項目は自分で除外する
+        if not item or float(item['expires_at']['N']) <= now:
+            return None
+        return json.loads(item['data']['S']), int(item['version']['N'])
+
+    def put(self, key, data, version, expected_version, expires_at):
+        """expected_version と一致する場合のみ書き込み、成否を返す"""
+        values = {':now': {'N': repr(time.time())}}
+        if expected_version == 0:
+            # 新規作成（期限切れの項目は上書きしてよい）
+            condition = 'attribute_not_exists(session_key) OR expires_at <= :now'
+        else:
+            condition = 'version = :expected AND expires_at > :now'
+            values[':expected'] = {'N': str(expected_version)}
+        try:
+            self._client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'session_key': {'S': key},
+                    'data': {'S': json.dumps(data, ensure_ascii=False)},
+                    'version': {'N': str(version)},
+                    'expires_at': {'N': repr(float(expires_at))}
+                },
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            return True
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def delete(self, key):
+        self._client.delete_item(TableName=self.table_name, Key={'session_key': {'S': key}})
+
+    def purge_expired(self, now):
+        """期限切れの項目は TTL で削除されるため何もしない"""
+        return 0
+
+
+class _CacheEntry:
+    __slots__ = ('data', 'version', 'persisted_version', 'expires_at', 'dirty', 'mutations', 'checked_at')
+
+    def __init__(self, data, version, persisted_version, expires_at, dirty=False):
+        self.data = data
+        self.version = version
+        self.persisted_version = persisted_version
+        self.expires_at = expires_at
+        self.dirty = dirty
+        # バックエンドから読み込んだ（書き込んだ）時刻。鮮度の判定に使う
+        self.checked_at = time.monotonic()
+        # 未書き込みの更新処理（update() の mutate）。put() で丸ごと置き換えた場合は再適用できないので None
+        self.mutations = []
+
+
+class SessionStore:
+    """LRUキャッシュ付きのセッションストア"""
+
+    def __init__(self, backend=None, capacity=None, ttl_seconds=None, freshness_seconds=None):
+        self.backend = backend or SQLiteSessionBackend()
+        self.capacity = capacity or int(os.environ.get('SESSION_CACHE_SIZE', '1000'))
+        self.ttl_seconds = ttl_seconds or float(os.environ.get('SESSION_TTL_SECONDS', '1800'))
+        if freshness_seconds is None:
+            freshness_seconds = float(os.environ.get('SESSION_CACHE_FRESHNESS_SECONDS', '5'))
+        self.freshness_seconds = freshness_seconds
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "flushed": 0, "conflicts": 0, "reapplied": 0, "lost": 0}
+
+    @staticmethod
+    def make_key(user_id, channel_id=None):
+        return f"{user_id}:{channel_id or ''}"
+
+    def get(self, user_id, channel_id=None):
+        """セッションを取得（キャッシュ → バックエンドの順に参照）
+
+        戻り値は {"data": dict, "version": int}。存在しなければ version 0 の空セッション。
+        data はコピーなので、変更後に put() で書き戻すこと。
+        キャッシュは freshness_seconds 以内に読み込んだもの（または未書き込みの更新）だけを使う。
+        """
+        key = self.make_key(user_id, channel_id)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry.expires_at > now and (
+                    entry.dirty or time.monotonic() - entry.checked_at < self.freshness_seconds):
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return {"data": copy.deepcopy(entry.data), "version": entry.version}
+
+            self.stats["misses"] += 1
+            loaded = self.backend.get(key, now)
+            if loaded is None:
+                data, version = {}, 0
+            else:
+                data, version = loaded
+            self._store_entry(key, _CacheEntry(data, version, version, now + self.ttl_seconds))
+            return {"data": copy.deepcopy(data), "version": version}
+
+    def put(self, user_id, channel_id, data, expected_version):
+        """セッションを更新し、新しいバージョンを返す
+
+        キャッシュ上のバージョンが expected_version と異なる場合は
+        VersionConflictError を送出する。バックエンドへの書き込みは flush() で行う。
+        """
+        return self._put(self.make_key(user_id, channel_id), data, expected_version, mutation=None)
+
+    def update(self, user_id, channel_id, mutate, max_attempts=MAX_UPDATE_ATTEMPTS):
+        """mutate(data) で会話状態をその場で更新し、新しいバージョンを返す
+
+        バージョンが競合した場合は最新の値を読み直して max_attempts 回まで再試行する。
+        mutate は flush() でバックエンドの値と競合した場合にも再適用するので、
+        data を書き換える以外の副作用を持たないこと。
+        """
+        key = self.make_key(user_id, channel_id)
+        for attempt in range(1, max_attempts + 1):
+            session = self.get(user_id, channel_id)
+            mutate(session["data"])
+            try:
+                return self._put(key, session["data"], session["version"], mutation=mutate)
+            except VersionConflictError:
+                if attempt == max_attempts:
+                    raise
+                logger.info(f"Session update conflict for {key}, retrying ({attempt}/{max_attempts})")
+
+    def _put(self, key, data, expected_version, mutation):
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry.expires_at <= now:
+                # キャッシュから追い出されている場合はバックエンドの値と比較
+                loaded = self.backend.get(key, now)
+                current_version = loaded[1] if loaded else 0
+                entry = _CacheEntry(loaded[0] if loaded else {}, current_version, current_version, now)
+            if entry.version != expected_version:
+                self.stats["conflicts"] += 1
+                raise VersionConflictError(key, expected_version, entry.version)
+
+            entry.data = copy.deepcopy(data)
+            if mutation is None:
+                entry.mutations = None
+            elif entry.mutations is not None:
+                entry.mutations.append(mutation)
+            entry.version = expected_version + 1
+            entry.expires_at = now + self.ttl_seconds
+            entry.dirty = True
+            self._store_entry(key, entry)
+            return entry.version
+
+    def delete(self, user_id, channel_id=None):
+        key = self.make_key(user_id, channel_id)
+        with self._lock:
+            self._cache.pop(key, None)
+        self.backend.delete(key)
+
+    def _store_entry(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            evicted_key, evicted = next(iter(self._cache.items()))
+            if evicted.dirty:
+                # 未書き込みの更新は追い出す前に書き込む
+                self._write_entry(evicted_key, evicted)
+            self._cache.pop(evicted_key, None)
+
+    def _write_entry(self, key, entry):
+        """エントリーをバックエンドに書き込む（"written" / "reapplied" / "lost" を返す）"""
+        ok = self.backend.put(key, entry.data, entry.version, entry.persisted_version, entry.expires_at)
+        if ok:
+            self._mark_persisted(entry)
+            return "written"
+
+        # 別のコンテナが先に更新していた。update() の更新処理なら最新の値に再適用する
+        self.stats["conflicts"] += 1
+        if entry.mutations is not None:
+            for _ in range(MAX_UPDATE_ATTEMPTS):
+                loaded = self.backend.get(key, time.time())
+                data, version = loaded if loaded is not None else ({}, 0)
+                for mutate in entry.mutations:
+                    mutate(data)
+                if self.backend.put(key, data, version + 1, version, entry.expires_at):
+                    entry.data = data
+                    entry.version = version + 1
+                    self._mark_persisted(entry)
+                    self.stats["reapplied"] += 1
+                    logger.info(f"Session write conflict for {key}, reapplied updates on version {version}")
+                    return "reapplied"
+                self.stats["conflicts"] += 1
+
+        # 再適用できない（put() で置き換えた、または競合が続いた）更新は破棄して呼び出し側に返す
+        self.stats["lost"] += 1
+        self._cache.pop(key, None)
+        logger.error(f"Session write conflict for {key}, discarding cached version {entry.version}")
+        return "lost"
+
+    def _mark_persisted(self, entry):
+        entry.persisted_version = entry.version
+        entry.dirty = False
+        entry.mutations = []
+        entry.checked_at = time.monotonic()
+        self.stats["flushed"] += 1
+
+    def flush(self):
+        """未書き込みの更新をバックエンドに書き込む
+
+        戻り値は {"written": 件数, "reapplied": 件数, "lost": [競合で破棄したセッションのキー]}。
+        """
+        result = {"written": 0, "reapplied": 0, "lost": []}
+        with self._lock:
+            for key, entry in list(self._cache.items()):
+                if not entry.dirty:
+                    continue
+                outcome = self._write_entry(key, entry)
+                if outcome == "lost":
+                    result["lost"].append(key)
+                else:
+                    result[outcome] += 1
+        return result
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def create_backend():
+    """SESSION_BACKEND の設定に応じたバックエンドを生成"""
+    backend = os.environ.get('SESSION_BACKEND', 'sqlite').lower()
+    if backend == 'dynamodb':
+        return DynamoDBSessionBackend()
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        logger.warning("SESSION_BACKEND=sqlite is local to this Lambda container; use dynamodb in production")
+    return SQLiteSessionBackend()
+
+
+def get_store():
+    """プロセス内で共有するセッションストアを取得"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = SessionStore(create_backend())
+    return _default_store
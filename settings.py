@@ -0,0 +1,214 @@
+"""アプリケーション設定の読み込み
+
+LINEWORKS_* の認証情報や各種設定を起動時に一度だけ読み込んで検証し、
+Settings オブジェクトとしてプロセス内にキャッシュする。ハンドラーは
+get_settings() の属性を参照するだけで、呼び出しごとに環境変数を読み直さない。
+
+認証情報はシークレットプロバイダー（SETTINGS_SECRETS_PROVIDER）から読み込むこともでき、
+その値は環境変数より優先される。シークレットは SETTINGS_SECRETS_TTL 秒ごとに
+読み込み直すため、鍵のローテーションは再デプロイなしで反映される。
+
+  file  JSON ファイル（SETTINGS_SECRETS_FILE、ローカル検証用の代替）
+  aws   AWS Secrets Manager（SETTINGS_SECRET_ID、boto3 を使用）
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bot ID の既定値
+DEFAULT_BOT_ID = '10207111'
+
+# 認証に必要な設定
+REQUIRED_CREDENTIALS = (
+    'LINEWORKS_CLIENT_ID',
+    'LINEWORKS_CLIENT_SECRET',
+    'LINEWORKS_SERVICE_ACCOUNT_ID',
+    'LINEWORKS_PRIVATE_KEY'
+)
+
+
+class SettingsError(ValueError):
+    """設定値が不正な場合の例外"""
+
+
+class Settings:
+    """検証済みの設定値（読み取り専用として扱う）"""
+
+    __slots__ = (
+        'client_id', 'client_secret', 'service_account_id', 'private_key', 'domain_id',
+        'bot_id', 'has_bot_id', 'app_version', 'webhook_debug_log', 'health_probe_ttl',
+        'scheduler_batch_size', 'scheduler_max_batches', 'http_connect_timeout', 'http_read_timeout',
+        'secrets_source', 'loaded_at'
+    )
+
+    def __init__(self, values, secrets_source=None):
+        self.client_id = values.get('LINEWORKS_CLIENT_ID') or None
+        self.client_secret = values.get('LINEWORKS_CLIENT_SECRET') or None
+        self.service_account_id = values.get('LINEWORKS_SERVICE_ACCOUNT_ID') or None
+        self.private_key = values.get('LINEWORKS_PRIVATE_KEY') or None
+        self.domain_id = values.get('LINEWORKS_DOMAIN_ID') or None
+        self.has_bot_id = bool(values.get('LINEWORKS_BOT_ID'))
+        self.bot_id = values.get('LINEWORKS_BOT_ID') or DEFAULT_BOT_ID
+        self.app_version = values.get('APP_VERSION') or '1.0.0'
+        self.webhook_debug_log = str(values.get('WEBHOOK_DEBUG_LOG', 'true')).lower() != 'false'
+        self.health_probe_ttl = _parse_number(values, 'HEALTH_PROBE_TTL', '30', float, minimum=0)
+        self.scheduler_batch_size = _parse_number(values, 'SCHEDULER_BATCH_SIZE', '100', int, minimum=1)
+        self.scheduler_max_batches = _parse_number(values, 'SCHEDULER_MAX_BATCHES', '10', int, minimum=1)
+        self.http_connect_timeout = _parse_number(values, 'HTTP_CONNECT_TIMEOUT', '3', float, minimum=0.1)
+        self.http_read_timeout = _parse_number(values, 'HTTP_READ_TIMEOUT', '10', float, minimum=0.1)
+        self.secrets_source = secrets_source
+        self.loaded_at = time.time()
+
+    @property
+    def missing_credentials(self):
+        """未設定の認証情報の環境変数名"""
+        values = {
+            'LINEWORKS_CLIENT_ID': self.client_id,
+            'LINEWORKS_CLIENT_SECRET': self.client_secret,
+            'LINEWORKS_SERVICE_ACCOUNT_ID': self.service_account_id,
+            'LINEWORKS_PRIVATE_KEY': self.private_key
+        }
+        return [name for name in REQUIRED_CREDENTIALS if not values[name]]
+
+    def __repr__(self):
+        # 認証情報はログに出さない
+        return (f"Settings(client_id={self.client_id!r}, bot_id={self.bot_id!r}, "
+                f"missing_credentials={self.missing_credentials}, secrets_source={self.secrets_source!r})")
+
+
+def _parse_number(values, name, default, cast, minimum):
+    raw = values.get(name)
+    if raw in (None, ''):
+        raw = default
+    try:
+        value = cast(raw)
+    except (TypeError, ValueError):
+        raise SettingsError(f"{name} must be a number: {raw!r}")
+    if value < minimum:
+        raise SettingsError(f"{name} must be >= {minimum}: {raw!r}")
+    return value
+
+
+class FileSecretsProvider:
+    """JSON ファイルからシークレットを読み込む（Secrets Manager のローカル代替）"""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ['SETTINGS_SECRETS_FILE']
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            values = json.load(f)
+        if not isinstance(values, dict):
+            raise SettingsError(f"Secrets file {self.path} must contain an object")
+        return values
+
+    def __str__(self):
+        return f"file:{self.path}"
+
+
+class AwsSecretsManagerProvider:
+    """AWS Secrets Manager からシークレット（JSON 形式の SecretString）を読み込む"""
+
+    def __init__(self, secret_id=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('secretsmanager')
+        self.secret_id = secret_id or os.environ['SETTINGS_SECRET_ID']
+        self._client = client
+
+    def load(self):
+        response = self._client.get_secret_value(SecretId=self.secret_id)
+        values = json.loads(response['SecretString'])
+        if not isinstance(values, dict):
+            raise SettingsError(f"Secret {self.secret_id} must be a JSON object")
+        return values
+
+    def __str__(self):
+        return f"aws:{self.secret_id}"
+
+
+def get_secrets_provider():
+    """SETTINGS_SECRETS_PROVIDER の設定に応じたプロバイダーを返す（未設定なら None）"""
+    provider = os.environ.get('SETTINGS_SECRETS_PROVIDER', '').lower()
+    if not provider:
+        return None
+    if provider == 'file':
+        return FileSecretsProvider()
+    if provider == 'aws':
+        return AwsSecretsManagerProvider()
+    raise SettingsError(f"Unknown SETTINGS_SECRETS_PROVIDER: {provider}")
+
+
+class SettingsLoader:
+    """設定の読み込みとキャッシュ（シークレットは TTL ごとに読み込み直す）"""
+
+    def __init__(self, environ=None, provider=None, ttl=None):
+        self._environ = dict(os.environ if environ is None else environ)
+        self.provider = provider
+        if ttl is None:
+            ttl = float(self._environ.get('SETTINGS_SECRETS_TTL', '300'))
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._settings = None
+        self._next_refresh = 0.0
+        self.refreshes = 0
+
+    def _load(self):
+        values = dict(self._environ)
+        if self.provider is not None:
+            values.update(self.provider.load())
+        return Settings(values, secrets_source=str(self.provider) if self.provider is not None else None)
+
+    def get(self):
+        """キャッシュ済みの設定を返す（シークレットの TTL が切れていれば読み込み直す）"""
+        settings = self._settings
+        if settings is not None and (self.provider is None or time.monotonic() < self._next_refresh):
+            return settings
+        return self.refresh()
+
+    def refresh(self, force=False):
+        """設定を読み込み直す（失敗した場合は前回の設定を使い続ける）"""
+        with self._lock:
+            if not force and self._settings is not None and time.monotonic() < self._next_refresh:
+                return self._settings
+            try:
+                settings = self._load()
+            except Exception as e:
+                if self._settings is None:
+                    raise
+                logger.error(f"Failed to refresh settings, keeping previous values: {str(e)}")
+                self._next_refresh = time.monotonic() + min(self.ttl, 30)
+                return self._settings
+
+            if settings.missing_credentials:
+                logger.warning(f"Missing credentials: {', '.join(settings.missing_credentials)}")
+            if self._settings is not None:
+                self.refreshes += 1
+                if settings.private_key != self._settings.private_key or settings.client_secret != self._settings.client_secret:
+                    logger.info("Rotated credentials loaded")
+            self._settings = settings
+            self._next_refresh = time.monotonic() + self.ttl
+            return settings
+
+
+_default_loader = None
+_default_loader_lock = threading.Lock()
+
+
+def get_loader():
+    global _default_loader
+    if _default_loader is None:
+        with _default_loader_lock:
+            if _default_loader is None:
+                _default_loader = SettingsLoader(provider=get_secrets_provider())
+    return _default_loader
+
+
+def get_settings():
+    """プロセス内で共有する設定を取得"""
+    return get_loader().get()
+
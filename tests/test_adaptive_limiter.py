@@ -0,0 +1,130 @@
+"""AdaptiveLimiter の上限調整とレーン配分のテスト"""
+import threading
+import time
+
+from adaptive_limiter import LANE_BULK, LANE_INTERACTIVE, AdaptiveLimiter
+
+# レイテンシの揺らぎで過負荷と判定されないようにする
+NO_LATENCY_CHECK = 1e9
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            raise AssertionError("condition not met before timeout")
+        time.sleep(0.001)
+
+
+def run_load(limiter, lane, threads=16, requests_per_thread=20, latency=0.005):
+    """lane だけで負荷をかけ、同時実行数の最大値を返す"""
+    peak = [0]
+    peak_lock = threading.Lock()
+
+    def worker():
+        for _ in range(requests_per_thread):
+            started = limiter.acquire(lane)
+            with peak_lock:
+                peak[0] = max(peak[0], limiter.snapshot()["in_flight"])
+            time.sleep(latency)
+            limiter.release(started, status_code=200, lane=lane)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return peak[0]
+
+
+def test_single_lane_load_grows_limit():
+    """一斉送信だけの負荷でも、レーンの枠まで使っていれば上限が伸びる"""
+    limiter = AdaptiveLimiter('test', initial_limit=4, max_limit=32, tolerance=NO_LATENCY_CHECK)
+
+    peak = run_load(limiter, LANE_BULK)
+
+    snapshot = limiter.snapshot()
+    assert snapshot["increases"] > 0
+    assert snapshot["limit"] > 4
+    assert peak > 2
+
+
+def test_idle_limit_does_not_grow():
+    """枠に余裕がある直列の呼び出しでは上限を増やさない"""
+    limiter = AdaptiveLimiter('test', initial_limit=4, max_limit=32, tolerance=NO_LATENCY_CHECK)
+
+    for _ in range(50):
+        started = limiter.acquire(LANE_INTERACTIVE)
+        limiter.release(started, status_code=200, lane=LANE_INTERACTIVE)
+
+    assert limiter.limit == 4
+    assert limiter.snapshot()["increases"] == 0
+
+
+def test_lane_share_caps_in_flight():
+    """上限が固定なら、一斉送信のレーンは上限 × share までしか同時に実行しない"""
+    limiter = AdaptiveLimiter('test', initial_limit=8, min_limit=8, max_limit=8,
+                              tolerance=NO_LATENCY_CHECK)
+
+    peak = run_load(limiter, LANE_BULK, threads=8, requests_per_thread=10)
+
+    assert peak <= 4
+
+
+def test_lanes_are_granted_by_weight():
+    """待機者が溜まっているときは weight の比で枠を割り当てる"""
+    lanes = {"fast": {"weight": 3.0, "share": 1.0}, "slow": {"weight": 1.0, "share": 1.0}}
+    limiter = AdaptiveLimiter('test', initial_limit=1, min_limit=1, max_limit=1,
+                              tolerance=NO_LATENCY_CHECK, lanes=lanes, default_lane="fast")
+    order = []
+    order_lock = threading.Lock()
+
+    def worker(lane):
+        started = limiter.acquire(lane)
+        with order_lock:
+            order.append(lane)
+        limiter.release(started, status_code=200, lane=lane)
+
+    holder = limiter.acquire("fast")
+    workers = [threading.Thread(target=worker, args=(lane,)) for lane in ["fast"] * 8 + ["slow"] * 8]
+    for thread in workers:
+        thread.start()
+    wait_until(lambda: sum(lane["queue_depth"] for lane in limiter.snapshot()["lanes"].values()) == 16)
+    limiter.release(holder, status_code=200, lane="fast")
+    for thread in workers:
+        thread.join()
+
+    first = order[:8]
+    assert first.count("fast") == 6
+    assert first.count("slow") == 2
+    assert sorted(order) == sorted(["fast"] * 8 + ["slow"] * 8)
+
+
+def test_throttling_backs_off_once_per_round_trip():
+    """429 / 5xx / 通信エラーで上限を backoff 倍に下げる（同じ混雑では1往復に1回まで）"""
+    limiter = AdaptiveLimiter('test', initial_limit=10, min_limit=1, max_limit=32, backoff=0.5)
+
+    first = limiter.acquire()
+    second = limiter.acquire()
+    time.sleep(0.01)
+    limiter.release(first, status_code=429)
+    limiter.release(second, status_code=503)
+
+    snapshot = limiter.snapshot()
+    assert snapshot["limit"] == 5
+    assert snapshot["decreases"] == 1
+    assert snapshot["throttled"] == 1
+
+    time.sleep(0.02)
+    third = limiter.acquire()
+    limiter.release(third, error=True)
+    assert limiter.limit == 2
+
+
+def test_backoff_stops_at_min_limit():
+    limiter = AdaptiveLimiter('test', initial_limit=2, min_limit=2, max_limit=32, backoff=0.1)
+
+    started = limiter.acquire()
+    limiter.release(started, status_code=500)
+
+    assert limiter.limit == 2
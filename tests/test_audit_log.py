@@ -0,0 +1,58 @@
+"""監査ログのログ転送と集約のテスト"""
+import gzip
+import io
+import json
+import time
+
+import pytest
+
+import audit_log
+
+
+@pytest.fixture
+def fresh_audit_log(monkeypatch):
+    monkeypatch.setattr(audit_log, '_default_log', audit_log._UNRESOLVED)
+    for name in ('AUDIT_ENABLED', 'AUDIT_S3_BUCKET', 'AUDIT_SHIPPER', 'AWS_LAMBDA_FUNCTION_NAME'):
+        monkeypatch.delenv(name, raising=False)
+    yield
+    monkeypatch.setattr(audit_log, '_default_log', audit_log._UNRESOLVED)
+
+
+def test_settings_are_resolved_once(fresh_audit_log, monkeypatch):
+    monkeypatch.setenv('AUDIT_ENABLED', 'true')
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'bot')
+    audit = audit_log.get_audit_log()
+    assert isinstance(audit, audit_log.LogShipper)
+
+    monkeypatch.setenv('AUDIT_ENABLED', 'false')
+    assert audit_log.get_audit_log() is audit
+
+
+def test_disabled_by_default(fresh_audit_log):
+    assert audit_log.get_audit_log() is None
+    audit_log.record(audit_log.DIRECTION_SENT, 'test')
+
+
+def test_shipped_lines_are_compacted_into_partitions(tmp_path):
+    stream = io.StringIO()
+    shipper = audit_log.LogShipper(stream)
+    for i in range(5):
+        shipper.record(audit_log.DIRECTION_SENT, 'broadcast', user_id=f"user-{i}", status='sent', status_code=200)
+    shipper.record(audit_log.DIRECTION_RECEIVED, 'webhook', status='unhandled')
+    lines = stream.getvalue().splitlines()
+
+    # CloudWatch Logs のサブスクリプション形式で、Firehose が改行なしで連結して届けたもの
+    envelopes = ''.join(json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "logEvents": [{"id": str(index), "message": line}, {"id": "x", "message": "START RequestId: abc"}]
+    }) for index, line in enumerate(lines))
+    sink = audit_log.LocalAuditSink(str(tmp_path))
+    audit = audit_log.AuditLog(sink, batch_size=100, file_format=audit_log.FORMAT_NDJSON)
+
+    written = audit_log.compact(audit, [audit_log._decode_input(gzip.compress(envelopes.encode()))])
+
+    assert written == 6
+    assert audit.flushed_files == 1
+    rows = list(audit_log.query(sink, time.time() - 60, filters={"direction": audit_log.DIRECTION_SENT}))
+    assert sorted(row["user_id"] for row in rows) == [f"user-{i}" for i in range(5)]
+    assert all(row["status_code"] == 200 for row in rows)
@@ -0,0 +1,116 @@
+"""デッドレターストアと一括再送のテスト"""
+import threading
+import time
+
+import pytest
+
+import dead_letter
+
+
+def make_dynamodb_store():
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    mock = moto.mock_aws()
+    mock.start()
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    client.create_table(
+        TableName='dead-letters',
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'status', 'AttributeType': 'S'}
+        ],
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'status-id',
+            'KeySchema': [
+                {'AttributeName': 'status', 'KeyType': 'HASH'},
+                {'AttributeName': 'id', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    store = dead_letter.DynamoDBDeadLetterStore(table_name='dead-letters', client=client)
+    store._mock = mock
+    return store
+
+
+@pytest.fixture(params=['sqlite', 'file', 'dynamodb'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        store = dead_letter.SQLiteDeadLetterStore(str(tmp_path / 'dead_letters.db'))
+    elif request.param == 'file':
+        store = dead_letter.FileDeadLetterStore(str(tmp_path / 'dead_letters'))
+    else:
+        store = make_dynamodb_store()
+    yield store
+    if hasattr(store, '_mock'):
+        store._mock.stop()
+
+
+def add_letters(store, count):
+    return [store.add({"user_id": f"user-{i}", "content": {"type": "text", "text": "x"}}, "HTTP 503", 'test')
+            for i in range(count)]
+
+
+def test_list_pending_pages_in_order(store):
+    ids = add_letters(store, 5)
+
+    first = store.list_pending(3)
+    rest = store.list_pending(10, after_id=first[-1]["id"])
+
+    assert [letter["id"] for letter in first + rest] == ids
+    assert first[0]["request"]["user_id"] == "user-0"
+    assert store.count_pending() == 5
+
+
+def test_redrive_removes_sent_and_keeps_failed(store):
+    add_letters(store, 6)
+
+    def send(request):
+        if request["user_id"] == "user-3":
+            return False, "HTTP 500"
+        return True, None
+
+    summary = dead_letter.redrive(store, send, batch_size=4, rate_per_second=0)
+
+    assert summary["redriven"] == 5
+    assert summary["failed"] == 1
+    assert summary["remaining"] == 1
+    [left] = store.list_pending(10)
+    assert left["request"]["user_id"] == "user-3"
+    assert left["reason"] == "HTTP 500"
+
+
+def test_redrive_sends_batch_concurrently(tmp_path):
+    store = dead_letter.SQLiteDeadLetterStore(str(tmp_path / 'dead_letters.db'))
+    add_letters(store, 40)
+    active = [0, 0]
+    lock = threading.Lock()
+
+    def send(request):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return True, None
+
+    started = time.monotonic()
+    summary = dead_letter.redrive(store, send, batch_size=20, rate_per_second=0, concurrency=8)
+
+    assert summary["redriven"] == 40
+    assert active[1] > 1
+    assert time.monotonic() - started < 40 * 0.02
+
+
+def test_redrive_stops_at_deadline(tmp_path):
+    store = dead_letter.SQLiteDeadLetterStore(str(tmp_path / 'dead_letters.db'))
+    add_letters(store, 10)
+
+    summary = dead_letter.redrive(store, lambda request: (True, None), deadline=time.monotonic() - 1)
+
+    assert summary["stopped_at_deadline"] is True
+    assert summary["redriven"] == 0
+    assert summary["remaining"] == 10
@@ -0,0 +1,39 @@
+"""テンプレートのコンパイルと描画のテスト"""
+import pytest
+
+from message_templates import TemplateError, compile_template
+
+
+def test_render_fills_parameters():
+    render = compile_template("{name} さん、進捗 100% です（{count} 件）")
+
+    assert render({"name": "山田", "count": 3}) == "山田 さん、進捗 100% です（3 件）"
+
+
+def test_render_single_parameter_keeps_tuple_value():
+    render = compile_template("値: {value}")
+
+    assert render({"value": (1, 2)}) == "値: (1, 2)"
+
+
+def test_render_with_format_spec():
+    render = compile_template("{rate:.1%} / {n:>3}")
+
+    assert render({"rate": 0.256, "n": 7}) == "25.6% /   7"
+
+
+def test_missing_parameter_raises_template_error():
+    with pytest.raises(TemplateError):
+        compile_template("{a} と {b}", 't')({"a": 1})
+    with pytest.raises(TemplateError):
+        compile_template("{n:d}", 't')({})
+
+
+def test_value_not_matching_format_spec_raises_template_error():
+    with pytest.raises(TemplateError):
+        compile_template("{n:d}", 't')({"n": "abc"})
+
+
+def test_nested_format_spec_is_rejected_at_compile_time():
+    with pytest.raises(TemplateError):
+        compile_template("{n:{w}}", 't')
@@ -0,0 +1,127 @@
+"""予約メッセージのストアと送信 tick のテスト"""
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+
+def make_sqlite_store(tmp_path):
+    return scheduler.ScheduledMessageStore(str(tmp_path / 'scheduled.db'))
+
+
+def make_dynamodb_store(tmp_path):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    mock = moto.mock_aws()
+    mock.start()
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    client.create_table(
+        TableName='scheduled',
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'status', 'AttributeType': 'S'},
+            {'AttributeName': 'due_at', 'AttributeType': 'N'}
+        ],
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': scheduler.DEFAULT_STATUS_INDEX,
+            'KeySchema': [
+                {'AttributeName': 'status', 'KeyType': 'HASH'},
+                {'AttributeName': 'due_at', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    store = scheduler.DynamoDBScheduledMessageStore(table_name='scheduled', client=client)
+    store._mock = mock
+    return store
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def store(request, tmp_path):
+    store = make_sqlite_store(tmp_path) if request.param == 'sqlite' else make_dynamodb_store(tmp_path)
+    yield store
+    if hasattr(store, '_mock'):
+        store._mock.stop()
+
+
+def enqueue_due(store, count):
+    now = time.time()
+    return [store.enqueue(f"user-{i}", f"message {i}", now - 1) for i in range(count)]
+
+
+def test_claim_due_leases_each_message_once(store):
+    enqueue_due(store, 5)
+    store.enqueue("later", "not yet", time.time() + 3600)
+
+    first = store.claim_due(time.time(), 3)
+    second = store.claim_due(time.time(), 10)
+
+    assert len(first) == 3
+    assert len(second) == 2
+    assert not {item["id"] for item in first} & {item["id"] for item in second}
+    assert all(item["attempts"] == 1 for item in first + second)
+
+
+def test_run_tick_sends_and_marks_each_message(store):
+    enqueue_due(store, 12)
+    sent = []
+    sent_lock = threading.Lock()
+
+    def send(item):
+        with sent_lock:
+            sent.append(item["user_id"])
+        return True, None
+
+    summary = scheduler.run_tick(store, send, batch_size=5, concurrency=4)
+
+    assert summary["sent"] == 12
+    assert sorted(sent) == sorted(f"user-{i}" for i in range(12))
+    assert store.claim_due(time.time() + 600, 100) == []
+    assert store.stats()["counts"].get(scheduler.STATUS_SENT) == 12
+
+
+def test_run_tick_releases_unsent_messages_at_deadline(store):
+    enqueue_due(store, 6)
+    sent = []
+
+    def send(item):
+        sent.append(item["id"])
+        return True, None
+
+    summary = scheduler.run_tick(store, send, deadline=time.monotonic() - 1)
+
+    assert summary["sent"] == 0
+    assert sent == []
+    # 締め切りを過ぎた tick は何も取り出さず、次の tick ですべて送信できる
+    again = store.claim_due(time.time(), 100)
+    assert len(again) == 6
+    assert all(item["attempts"] == 1 for item in again)
+
+
+def test_run_tick_retries_then_reports_failure(store):
+    enqueue_due(store, 1)
+    failed = []
+
+    def send(item):
+        return False, "HTTP 500"
+
+    now = time.time()
+    first = scheduler.run_tick(store, send, now=now, max_attempts=2, retry_delay=10,
+                               on_failed=lambda item, error: failed.append(error))
+    second = scheduler.run_tick(store, send, now=now + 11, max_attempts=2, retry_delay=10,
+                                on_failed=lambda item, error: failed.append(error))
+
+    assert first["retried"] == 1
+    assert second["failed"] == 1
+    assert failed == ["HTTP 500"]
+
+
+def test_cancel_only_pending(store):
+    message_id = store.enqueue("user", "text", time.time() + 60)
+
+    assert store.cancel(message_id) is True
+    assert store.cancel(message_id) is False
@@ -0,0 +1,93 @@
+"""会話状態ストアのテスト（キャッシュの鮮度と競合時の再適用）"""
+import time
+
+import pytest
+
+import session_store
+
+
+def increment(data):
+    data["n"] = data.get("n", 0) + 1
+
+
+def make_dynamodb_backend():
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    mock = moto.mock_aws()
+    mock.start()
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    client.create_table(
+        TableName='sessions',
+        AttributeDefinitions=[{'AttributeName': 'session_key', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'session_key', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    backend = session_store.DynamoDBSessionBackend(table_name='sessions', client=client)
+    backend._mock = mock
+    return backend
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        backend = session_store.SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    else:
+        backend = make_dynamodb_backend()
+    yield backend
+    if hasattr(backend, '_mock'):
+        backend._mock.stop()
+
+
+def test_backend_put_checks_version(backend):
+    expires_at = time.time() + 60
+
+    assert backend.put('k', {"n": 1}, 1, 0, expires_at) is True
+    assert backend.put('k', {"n": 1}, 1, 0, expires_at) is False
+    assert backend.put('k', {"n": 2}, 2, 1, expires_at) is True
+    assert backend.put('k', {"n": 9}, 2, 1, expires_at) is False
+    assert backend.get('k', time.time()) == ({"n": 2}, 2)
+
+
+def test_cached_entry_is_refreshed_from_backend(backend):
+    """別のストア（コンテナ）の書き込みは鮮度の期限を過ぎたら見える"""
+    store_a = session_store.SessionStore(backend, freshness_seconds=0.05)
+    store_b = session_store.SessionStore(backend, freshness_seconds=0.05)
+
+    store_a.update('user', None, increment)
+    store_a.flush()
+    assert store_b.get('user')["data"] == {"n": 1}
+
+    store_a.update('user', None, increment)
+    store_a.flush()
+    time.sleep(0.06)
+
+    assert store_b.get('user') == {"data": {"n": 2}, "version": 2}
+
+
+def test_flush_conflict_reapplies_updates(backend):
+    store_a = session_store.SessionStore(backend, freshness_seconds=60)
+    store_b = session_store.SessionStore(backend, freshness_seconds=60)
+    store_a.get('user')
+    store_b.get('user')
+
+    store_a.update('user', None, increment)
+    store_b.update('user', None, increment)
+    assert store_a.flush()["written"] == 1
+    result = store_b.flush()
+
+    assert result["reapplied"] == 1
+    assert backend.get('user:', time.time())[0] == {"n": 2}
+
+
+def test_flush_conflict_reports_replaced_session(backend):
+    store_a = session_store.SessionStore(backend, freshness_seconds=60)
+    store_b = session_store.SessionStore(backend, freshness_seconds=60)
+    store_a.get('user')
+    store_b.get('user')
+
+    store_a.update('user', None, increment)
+    store_b.put('user', None, {"n": 100}, 0)
+    store_a.flush()
+
+    assert store_b.flush()["lost"] == ['user:']
+    assert store_b.stats["lost"] == 1
@@ -0,0 +1,404 @@
+"""コンテナ間で共有するアクセストークンのキャッシュ
+
+スケールアウト時に Lambda コンテナ / Azure ワーカーがそれぞれトークンを
+発行しないよう、発行済みのトークンを外部ストアで共有する。
+
+トークンの更新はリース方式で、有効期限が近づいたときにリースを取得できた
+1ワーカーだけがトークンを発行し、ほかのワーカーは更新が終わるまで
+現在のトークン（まだ有効なもの）を使い続ける。
+
+ストアは次のメソッドを持つオブジェクト（TOKEN_STORE で選択）:
+
+    get(key)                          トークン（access_token / fetched_at / expires_at の dict）または None
+    put(key, token)                   トークンを保存
+    acquire_lease(key, owner, ttl)    リースを取得できたら True（期限切れのリースは奪える）
+    release_lease(key, owner)         自分のリースを解放
+    invalidate(key, access_token)     保存中のトークンが access_token と一致すれば破棄
+
+  sqlite    ローカル検証用（同じホストのプロセス間で共有）
+  redis     Redis（redis パッケージを使用）
+  dynamodb  DynamoDB（boto3 を使用）
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# SQLiteファイルの既定パス（Lambdaでは /tmp のみ書き込み可能）
+DEFAULT_DB_PATH = '/tmp/token_cache.db'
+
+
+class SQLiteTokenStore:
+    """SQLite によるトークンストア（ローカル検証用）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get('TOKEN_STORE_PATH', DEFAULT_DB_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS access_tokens (
+                    key TEXT PRIMARY KEY,
+                    access_token TEXT,
+                    fetched_at REAL,
+                    expires_at REAL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL
+                )
+            """)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT access_token, fetched_at, expires_at FROM access_tokens WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None or not row['access_token']:
+            return None
+        return {
+            "access_token": row['access_token'],
+            "fetched_at": row['fetched_at'],
+            "expires_at": row['expires_at']
+        }
+
+    def put(self, key, token):
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO access_tokens (key, access_token, fetched_at, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    access_token = excluded.access_token,
+                    fetched_at = excluded.fetched_at,
+                    expires_at = excluded.expires_at
+                """,
+                (key, token['access_token'], token['fetched_at'], token['expires_at'])
+            )
+
+    def acquire_lease(self, key, owner, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO access_tokens (key) VALUES (?)", (key,))
+            cursor = self._conn.execute(
+                """
+                UPDATE access_tokens SET lease_owner = ?, lease_expires_at = ?
+                WHERE key = ? AND (lease_owner IS NULL OR lease_expires_at < ?)
+                """,
+                (owner, now + ttl, key, now)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, key, owner):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE access_tokens SET lease_owner = NULL, lease_expires_at = NULL WHERE key = ? AND lease_owner = ?",
+                (key, owner)
+            )
+
+    def invalidate(self, key, access_token):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE access_tokens SET access_token = NULL WHERE key = ? AND access_token = ?",
+                (key, access_token)
+            )
+
+
+class RedisTokenStore:
+    """Redis によるトークンストア
+
+    トークンは有効期限付きのキー、リースは SET NX PX で取得する。
+    解放・破棄は自分のリース / 同じトークンの場合だけ消すよう Lua スクリプトで行う。
+    """
+
+    _RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    _INVALIDATE_SCRIPT = """
+        local value = redis.call('get', KEYS[1])
+        if value and cjson.decode(value)['access_token'] == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client=None, url=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or os.environ['TOKEN_STORE_URL'])
+        self._client = client
+
+    def get(self, key):
+        value = self._client.get(key)
+        return json.loads(value) if value else None
+
+    def put(self, key, token):
+        ttl = max(1, int(token['expires_at'] - time.time()))
+        self._client.set(key, json.dumps(token), ex=ttl)
+
+    def acquire_lease(self, key, owner, ttl):
+        return bool(self._client.set(f"{key}:lease", owner, nx=True, px=int(ttl * 1000)))
+
+    def release_lease(self, key, owner):
+        self._client.eval(self._RELEASE_SCRIPT, 1, f"{key}:lease", owner)
+
+    def invalidate(self, key, access_token):
+        self._client.eval(self._INVALIDATE_SCRIPT, 1, key, access_token)
+
+
+class DynamoDBTokenStore:
+    """DynamoDB によるトークンストア（パーティションキー pk の1項目にトークンとリースを保持）
+
+    リースは条件付き更新で取得する。テーブルの TTL 属性には expires_at を設定できる。
+    """
+
+    def __init__(self, table_name=None, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+        self.table_name = table_name or os.environ['TOKEN_STORE_TABLE']
+        self._client = client
+
+    def get(self, key):
+        item = self._client.get_item(
+            TableName=self.table_name,
+            Key={'pk': {'S': key}},
+            ConsistentRead=True
+        ).get('Item')
+        if not item or 'access_token' not in item:
+            return None
+        return {
+            "access_token": item['access_token']['S'],
+            "fetched_at": float(item['fetched_at']['N']),
+            "expires_at": float(item['expires_at']['N'])
+        }
+
+    def put(self, key, token):
+        self._client.update_item(
+            TableName=self.table_name,
+            Key={'pk': {'S': key}},
+            UpdateExpression='SET access_token = :token, fetched_at = :fetched, expires_at = :expires',
+            ExpressionAttributeValues={
+                ':token': {'S': token['access_token']},
+                ':fetched': {'N': str(token['fetched_at'])},
+                ':expires': {'N': str(token['expires_at'])}
+            }
+        )
+
+    def acquire_lease(self, key, owner, ttl):
+        now = time.time()
+        try:
+            self._client.update_item(
+                TableName=self.table_name,
+                Key={'pk': {'S': key}},
+                UpdateExpression='SET lease_owner = :owner, lease_expires_at = :lease_expires',
+                ConditionExpression='attribute_not_exists(lease_owner) OR lease_expires_at < :now',
+                ExpressionAttributeValues={
+                    ':owner': {'S': owner},
+                    ':lease_expires': {'N': str(now + ttl)},
+                    ':now': {'N': str(now)}
+                }
+            )
+            return True
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def release_lease(self, key, owner):
+        try:
+            self._client.update_item(
+                TableName=self.table_name,
+                Key={'pk': {'S': key}},
+                UpdateExpression='REMOVE lease_owner, lease_expires_at',
+                ConditionExpression='lease_owner = :owner',
+                ExpressionAttributeValues={':owner': {'S': owner}}
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def invalidate(self, key, access_token):
+        try:
+            self._client.update_item(
+                TableName=self.table_name,
+                Key={'pk': {'S': key}},
+                UpdateExpression='REMOVE access_token',
+                ConditionExpression='access_token = :token',
+                ExpressionAttributeValues={':token': {'S': access_token}}
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+class SharedTokenCache:
+    """プロセス内キャッシュ + 共有ストア + リースによるトークンの取得
+
+    fetch() はトークンを発行し、access_token / fetched_at / expires_at の dict
+    （失敗時は None）を返す関数。store が None の場合はプロセス内でだけ共有する。
+    """
+
+    def __init__(self, store, key, refresh_margin=300, lease_seconds=None,
+                 wait_seconds=None, poll_interval=0.2):
+        self.store = store
+        self.key = key
+        self.refresh_margin = refresh_margin
+        self.lease_seconds = lease_seconds or float(os.environ.get('TOKEN_LEASE_SECONDS', '30'))
+        if wait_seconds is None:
+            wait_seconds = float(os.environ.get('TOKEN_LEASE_WAIT_SECONDS', '5'))
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._lock = threading.Lock()
+        self._local = None
+        self.fetches = 0
+        self.shared_hits = 0
+
+    def _fresh(self, token, now):
+        return bool(token) and token['expires_at'] - self.refresh_margin > now
+
+    def _usable(self, token, now):
+        return bool(token) and token['expires_at'] - min(self.refresh_margin, 30) > now
+
+    def _fetch(self, fetch):
+        token = fetch()
+        self.fetches += 1
+        if token:
+            if self.store is not None:
+                try:
+                    self.store.put(self.key, token)
+                except Exception as e:
+                    logger.error(f"Failed to store shared access token: {str(e)}")
+            self._local = token
+        return token
+
+    def get_token(self, fetch):
+        """有効なトークンの dict を返す（取得できなければ None）"""
+        token = self._local
+        if self._fresh(token, time.time()):
+            return token
+
+        # 同じプロセス内では1スレッドだけが更新処理に進む
+        with self._lock:
+            now = time.time()
+            token = self._local
+            if self._fresh(token, now):
+                return token
+            if self.store is None:
+                return self._fetch(fetch) or (token if self._usable(token, now) else None)
+
+            try:
+                shared = self.store.get(self.key)
+            except Exception as e:
+                logger.error(f"Failed to read shared access token: {str(e)}")
+                return self._fetch(fetch)
+            if self._fresh(shared, now):
+                self.shared_hits += 1
+                self._local = shared
+                return shared
+
+            # 期限が近いトークンでも、まだ使えるものは更新中に使い続ける
+            candidates = [t for t in (shared, token) if self._usable(t, now)]
+            current = max(candidates, key=lambda t: t['expires_at']) if candidates else None
+
+            try:
+                leased = self.store.acquire_lease(self.key, self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Failed to acquire token refresh lease: {str(e)}")
+                return self._fetch(fetch) or current
+            if leased:
+                try:
+                    logger.info("Acquired token refresh lease")
+                    return self._fetch(fetch) or current
+                finally:
+                    self.store.release_lease(self.key, self.owner)
+
+            # ほかのワーカーが更新中
+            if current is not None:
+                self._local = current
+                return current
+
+            # 使えるトークンがなければ更新が終わるのを待つ
+            deadline = time.monotonic() + self.wait_seconds
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                shared = self.store.get(self.key)
+                if self._usable(shared, time.time()):
+                    self.shared_hits += 1
+                    self._local = shared
+                    return shared
+
+            # リースを持つワーカーが応答しない場合は自分で発行する
+            logger.warning("Token refresh lease holder did not respond, fetching token directly")
+            return self._fetch(fetch)
+
+    def invalidate(self, access_token=None):
+        """トークンを破棄する（API が 401 を返した場合など）"""
+        token = self._local
+        if access_token is None and token:
+            access_token = token['access_token']
+        if token and token['access_token'] == access_token:
+            self._local = None
+        if self.store is not None and access_token:
+            try:
+                self.store.invalidate(self.key, access_token)
+            except Exception as e:
+                logger.error(f"Failed to invalidate shared access token: {str(e)}")
+
+    def snapshot(self):
+        """キャッシュの状態（ヘルスチェック用）"""
+        token = self._local
+        now = time.time()
+        return {
+            "cached": bool(token),
+            "store": type(self.store).__name__ if self.store is not None else None,
+            "cache_age_seconds": round(now - token['fetched_at'], 1) if token else None,
+            "expires_in_seconds": round(token['expires_at'] - now, 1) if token else None,
+            "fetches": self.fetches,
+            "shared_hits": self.shared_hits
+        }
+
+
+def get_token_store():
+    """TOKEN_STORE の設定に応じたストアを返す（未設定ならプロセス内のみ）"""
+    backend = os.environ.get('TOKEN_STORE', '').lower()
+    if not backend:
+        return None
+    if backend == 'sqlite':
+        return SQLiteTokenStore()
+    if backend == 'redis':
+        return RedisTokenStore()
+    if backend == 'dynamodb':
+        return DynamoDBTokenStore()
+    raise ValueError(f"Unknown TOKEN_STORE: {backend}")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_token_cache(refresh_margin=300):
+    """プロセス内で共有するトークンキャッシュを取得"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                key = f"lineworks-token:{settings.get_settings().client_id or 'default'}:bot"
+                _default_cache = SharedTokenCache(get_token_store(), key, refresh_margin=refresh_margin)
+    return _default_cache
@@ -0,0 +1,107 @@
+"""Webhookイベントの種類ごとのハンドラー登録と振り分け
+
+(イベントタイプ, コンテンツタイプ) をキーにハンドラー関数を登録し、
+受信時は辞書の1回の参照でハンドラーを決める。コンテンツタイプを
+指定せずに登録したハンドラーは、そのイベントタイプの全コンテンツタイプに使う
+（解決結果は振り分け表に記録し、次回からは1回の参照で済む）。
+
+ハンドラーが登録されていないイベントは resolve() が None を返すので、
+呼び出し側はログ出力などの処理をせずにすぐ応答を返せる。
+ハンドラーごとに呼び出し回数・エラー数・処理時間を集計する。
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 未登録の組み合わせを振り分け表に記録する上限（任意の type 文字列で表が膨らまないように）
+MAX_NEGATIVE_ENTRIES = 256
+
+
+class _HandlerStats:
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+class EventDispatcher:
+    """Webhookイベントの振り分け表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._table = {}
+        self._negative_entries = 0
+        self._stats = {}
+        self.unhandled = 0
+
+    def register(self, event_type, content_type=None):
+        """ハンドラーを登録するデコレーター（content_type=None はそのイベントタイプ全体）"""
+        def decorator(handler):
+            with self._lock:
+                self._handlers[(event_type, content_type)] = handler
+                self._stats.setdefault(handler.__name__, _HandlerStats())
+                # 解決済みの振り分け結果は登録のたびに作り直す
+                self._table = dict(self._handlers)
+                self._negative_entries = 0
+            return handler
+        return decorator
+
+    def resolve(self, event_type, content_type=None):
+        """イベントに対応するハンドラーを返す（未登録なら None）"""
+        key = (event_type, content_type)
+        try:
+            return self._table[key]
+        except KeyError:
+            pass
+
+        handler = self._handlers.get((event_type, None))
+        with self._lock:
+            if handler is not None or self._negative_entries < MAX_NEGATIVE_ENTRIES:
+                if handler is None:
+                    self._negative_entries += 1
+                self._table[key] = handler
+        return handler
+
+    def record_unhandled(self):
+        self.unhandled += 1
+
+    def dispatch(self, handler, *args, **kwargs):
+        """ハンドラーを呼び出し、処理時間を集計する"""
+        stats = self._stats[handler.__name__]
+        started = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            if elapsed_ms > stats.max_ms:
+                stats.max_ms = elapsed_ms
+
+    def stats(self):
+        """登録済みハンドラーとハンドラーごとの処理時間を返す"""
+        return {
+            "routes": sorted(
+                f"{event_type}/{content_type or '*'}"
+                for event_type, content_type in self._handlers
+            ),
+            "unhandled": self.unhandled,
+            "handlers": {
+                name: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "avg_ms": round(stats.total_ms / stats.calls, 2) if stats.calls else None,
+                    "max_ms": round(stats.max_ms, 2)
+                }
+                for name, stats in self._stats.items()
+            }
+        }
@@ -0,0 +1,64 @@
+"""Webhookイベントのコンパクトな表現
+
+LINE WORKS から届く Webhook ボディのうち、処理に使うフィールド
+（type / userId / channelId / content の type と text）だけを __slots__ の
+属性として保持する。ボディ全体やヘッダーを dict のまま残さないため、
+128MB のメモリでもログ用のエントリが場所を取らない。
+
+生のボディはデバッグログが有効な場合だけ bytes で保持する。
+"""
+
+
+class WebhookEvent:
+    """処理に必要なフィールドだけを持つ Webhook イベント"""
+
+    __slots__ = ('type', 'user_id', 'channel_id', 'content_type', 'text', 'issued_time', 'raw')
+
+    def __init__(self, type=None, user_id=None, channel_id=None, content_type=None,
+                 text=None, issued_time=None, raw=None):
+        self.type = type
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.content_type = content_type
+        self.text = text
+        self.issued_time = issued_time
+        self.raw = raw
+
+    @classmethod
+    def from_body(cls, body, raw=None):
+        """パース済みの Webhook ボディ（dict）から生成"""
+        if not isinstance(body, dict):
+            return cls(raw=raw)
+        source = body.get('source') or {}
+        content = body.get('content') or {}  # LINE WORKSでは'content'キーを使用
+        return cls(
+            type=body.get('type'),
+            user_id=source.get('userId'),
+            channel_id=source.get('channelId'),
+            content_type=content.get('type'),
+            text=content.get('text'),
+            issued_time=body.get('issuedTime'),
+            raw=raw
+        )
+
+    @property
+    def raw_text(self):
+        return self.raw.decode('utf-8', errors='replace') if self.raw is not None else None
+
+    def to_log_dict(self):
+        """ログ出力・表示用の dict に変換"""
+        result = {
+            "type": self.type,
+            "user_id": self.user_id,
+            "channel_id": self.channel_id,
+            "content_type": self.content_type,
+            "text": self.text,
+            "issued_time": self.issued_time
+        }
+        if self.raw is not None:
+            result["raw_body"] = self.raw_text
+        return result
+
+    def __repr__(self):
+        return (f"WebhookEvent(type={self.type!r}, user_id={self.user_id!r}, "
+                f"channel_id={self.channel_id!r}, content_type={self.content_type!r})")